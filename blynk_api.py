@@ -8,13 +8,28 @@
     https://{server_address}/external/api/batch/update?token={token}&{pin1}={value1}&{pin2}={value2}
     
     eg: https://blynk.cloud/external/api/batch/update?token=ffujYGgbf805tgsf&v1=100&v2=200
+    
+    POST https://{server_address}/external/api/batch/update?token={token}&pin={pin}
+    body: [[timestamp in ms, value], ...]   (timestamped history of one pin)
+    
+    BlynkUploader sends in the background
+    -> every reading is stored in a local telemetry buffer first
+    -> the newest value of every pin in one batch request over a pooled session
+    -> readings buffered while offline are uploaded in bulk per pin with the time they were taken
+    -> failed uploads are retried with exponential backoff, readings are never lost
+    eg: uploader.send(moisture, species, water_content, water_needed)
 """
 
 import os
 import requests
-from time import sleep
+import threading
+from time import sleep, time
 from random import randint
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from telemetry_buffer import TelemetryBuffer
+from metrics import stage, http_error
+from hardware import BACKEND, create_session
 
 # Load environment variables
 load_dotenv()
@@ -28,6 +43,19 @@ SPECIES = 1       # string
 WATER_CONTENT = 2 # int
 WATER_NEEDED = 3  # int
 
+BATCH_URL = "https://blynk.cloud/external/api/batch/update"
+TIMEOUT = (2, 5)        # Connect and read timeout, fail fast when out of Wi-Fi range
+BACKOFF = 1.0           # Seconds before the first retry, doubled every retry
+MAX_BACKOFF = 60.0
+LIVE_WINDOW = 30.0      # Older readings are also uploaded with their timestamps
+
+# Readings are kept here until Blynk accepted them, simulated runs never share them
+TELEMETRY_DB = "sim_telemetry.db" if BACKEND == "sim" else "telemetry.db"
+MAX_BUFFERED = 10000    # TODO: Change
+
+session = create_session()
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
 def get_sensor_data():
     return {
         "moisture": randint(0, 100),
@@ -36,15 +64,136 @@ def get_sensor_data():
         "water_needed": randint(0, 100)
     }
 
+def pin_values(*data):
+    """Map values to their virtual pins, the nth value goes to pin vn. Missing values (None) are left out."""
+    return {f"v{index}": value for index, value in enumerate(data) if value is not None}
+
+def blynk_request(method: str, params: dict, body = None) -> bool:
+    """Make one request to the batch endpoint, returns True on success."""
+    try:
+        with stage("send_data_to_blynk"):
+            response = session.request(method, BATCH_URL, params={"token": BLYNK_AUTH, **params}, json=body, timeout=TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        http_error("blynk", e)
+        print(f"\n\033[31mError: Failed to send data to Blynk: {e}\033[0m")
+        return False
+    if response.status_code != 200:
+        http_error("blynk", response.status_code)
+        print(f"\n\033[31mError: Failed to send data to Blynk. Status code: {response.status_code}\033[0m")
+        print(f"\033[31mData tried to send: {params if body is None else body}\n\033[0m")
+        return False
+    return True
+
+def send_batch(values: dict) -> bool:
+    """Send several virtual pin values in one batch request, returns True on success."""
+    return blynk_request("GET", values)
+
+def send_timestamped(pin: str, points: list) -> bool:
+    """Upload [[created (unix seconds), value], ...] of one pin in one request, returns True on success."""
+    return blynk_request("POST", {"pin": pin}, [[int(created * 1000), value] for created, value in points])
+
 def send_data_to_blynk(*data):
-    for index, value in enumerate(data):
-        url = f"https://blynk.cloud/external/api/update?token={BLYNK_AUTH}&v{index}={value}"
-        response = requests.get(url, timeout=5)
-        if response.status_code != 200:
-            print(f"\n\033[31mError: Failed to send data to Blynk. Status code: {response.status_code}\033[0m")
-            print(f"\033[31mData tried to send: {index} = {value}\n\033[0m")
-            continue
-    print("\033[32mAll data has been processed.\033[0m")
+    if send_batch(pin_values(*data)):
+        print("\033[32mAll data has been processed.\033[0m")
+
+# MARK: Uploader
+class BlynkUploader:
+    """
+    Uploads pin values in the background so callers never wait on the network.
+    
+    Every reading is stored in a TelemetryBuffer first. The worker uploads the
+    unsent readings of every pin in one timestamped request (when there is a
+    backlog) and the newest value of every pin in one batch request, and marks
+    them sent only when Blynk accepted all of them. While offline the readings stay on disk
+    and the flush is retried with exponential backoff, also across restarts.
+    """
+    def __init__(self, buffer_path: str = TELEMETRY_DB, backoff: float = BACKOFF) -> None:
+        self.buffer_path = buffer_path
+        self.backoff = backoff
+        self.buffer: TelemetryBuffer | None = None
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopping = False
+        self.sent = 0
+        self.failed = 0
+    
+    def start(self) -> None:
+        """Open the buffer and start the worker, which first flushes readings left from earlier runs."""
+        with self.lock:
+            if self.buffer is None:
+                self.buffer = TelemetryBuffer(self.buffer_path, MAX_BUFFERED)
+            if self.thread is None or not self.thread.is_alive():
+                self.stopping = False
+                self.thread = threading.Thread(target=self.worker, daemon=True)
+                self.thread.start()
+                self.wake.set()
+    
+    def send(self, *data) -> None:
+        """Record the values of one stop and wake the worker, the nth value goes to pin vn."""
+        self.start()
+        self.buffer.record(pin_values(*data))
+        self.wake.set()
+    
+    def flush(self, limit: int = 500) -> bool:
+        """Upload unsent readings in bulk, returns False if Blynk could not be reached."""
+        rows = self.buffer.unsent(limit)
+        if not rows:
+            return True
+        
+        newest, history = {}, {}
+        for _, created, pins in rows:
+            for pin, value in pins.items():
+                history.setdefault(pin, []).append((created, value))
+                newest[pin] = value
+        
+        # A backlog keeps the time every reading was taken, a retry overwrites the same timestamps
+        if len(rows) > 1 or time() - rows[0][1] > LIVE_WINDOW:
+            print(f"Uploading {len(rows)} buffered Blynk readings with their timestamps")
+            for pin, points in history.items():
+                if not send_timestamped(pin, points):
+                    self.failed += 1
+                    return False
+        
+        if not send_batch(newest):
+            self.failed += 1
+            return False
+        
+        self.buffer.mark_sent([row_id for row_id, _, _ in rows])
+        self.sent += len(rows)
+        if len(rows) == limit:
+            self.wake.set()
+        return True
+    
+    def worker(self) -> None:
+        delay = None
+        while True:
+            self.wake.wait(delay)
+            self.wake.clear()
+            
+            try:
+                flushed = self.flush()
+            except Exception as e:
+                print(f"\033[31mError flushing telemetry: {e}\033[0m")
+                flushed = False
+            
+            if self.stopping and (not flushed or not self.wake.is_set()):
+                if not flushed:
+                    print(f"\033[33m{self.buffer.pending()} readings kept for the next upload\033[0m")
+                return
+            
+            # Retry unsent readings later, doubling the wait while offline
+            delay = None if flushed else min((delay or self.backoff / 2) * 2, MAX_BACKOFF)
+    
+    def close(self, timeout: float = 10.0) -> None:
+        """Try a last flush and stop the worker, unsent readings stay in the buffer."""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.stopping = True
+        self.wake.set()
+        self.thread.join(timeout)
+
+uploader = BlynkUploader()
 
 if __name__ == "__main__":
     try:
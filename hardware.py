@@ -0,0 +1,302 @@
+# hardware.py
+"""
+    Code that selects the hardware backend
+    
+    Every module gets its GPIO, ADC, camera, HTTP session and clock from here
+    -> "pi"  : RPi.GPIO, Adafruit_ADS1x15, Picamera2, requests and real time
+    -> "sim" : simulated GPIO / PWM / ADC, synthetic camera frames, canned OpenWeatherMap
+               and Blynk responses (no network) and a discrete event virtual clock
+    Select with the PLANTPULSE_BACKEND environment variable (default "pi")
+    Pins are read from config.json once with load_config
+    eg: PLANTPULSE_BACKEND=sim python main.py
+    
+    The virtual clock only moves while every thread sleeps, so concurrent sleeps on
+    different threads overlap exactly as they would on the rover and the simulated
+    timings are the same on any host. Computation takes no virtual time.
+"""
+
+import os
+import json
+import asyncio
+import random
+import threading
+import time as _time
+from functools import lru_cache
+
+BACKEND: str = os.environ.get("PLANTPULSE_BACKEND", "pi").lower()
+
+# MARK: Config
+@lru_cache(maxsize=None)
+def load_config(file_path: str = "config.json") -> dict:
+    """Load the selected pins from config.json once, every module shares the result."""
+    with open(file_path, "r") as f:
+        config = json.load(f)
+        f.close()
+    return config
+
+# MARK: Clock
+class Clock:
+    """
+    Real time, sleep blocks for the full duration.
+    """
+    def time(self) -> float:
+        return _time.time()
+    
+    def monotonic(self) -> float:
+        return _time.monotonic()
+    
+    def sleep(self, seconds: float) -> None:
+        _time.sleep(seconds)
+    
+    async def sleep_async(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+    
+    def wait(self, event: threading.Event, seconds: float) -> bool:
+        """Sleep until event is set or seconds passed, True if the event was set."""
+        return event.wait(max(seconds, 0))
+
+class VirtualClock(Clock):
+    """
+    Discrete event time: it only moves in sleep / wait, never while code runs.
+    Every sleeping thread registers its wake time, once no other thread has been
+    running for GRACE real seconds the clock jumps to the earliest wake time.
+    So timings do not depend on how fast the host is, computation takes no time.
+    """
+    GRACE: float = 0.02  # Real seconds a thread may compute between two sleeps
+    POLL: float = 0.002  # Real seconds between checks of the events being waited for
+    
+    def __init__(self) -> None:
+        self.now: float = 0.0
+        self.epoch: float = _time.time()
+        self.condition = threading.Condition()
+        self.sleepers: dict[int, float] = {}  # Thread -> virtual wake time
+        self.running: dict[int, float] = {}   # Thread -> real time it returned from its last sleep
+    
+    def monotonic(self) -> float:
+        return self.now
+    
+    def time(self) -> float:
+        return self.epoch + self.now
+    
+    def sleep(self, seconds: float) -> None:
+        self.wait(None, seconds)
+    
+    async def sleep_async(self, seconds: float) -> None:
+        # A worker thread sleeps for the event loop, so the loop itself never blocks
+        await asyncio.get_running_loop().run_in_executor(None, self.sleep, seconds)
+    
+    def wait(self, event: threading.Event | None, seconds: float) -> bool:
+        thread = threading.get_ident()
+        with self.condition:
+            wake = self.now + max(seconds, 0)
+            self.running.pop(thread, None)
+            self.sleepers[thread] = wake
+            try:
+                while not (event is not None and event.is_set()) and self.now < wake:
+                    self.advance()
+                    if self.now < wake:
+                        self.condition.wait(self.POLL)
+                return event is not None and event.is_set()
+            finally:
+                del self.sleepers[thread]
+                self.running[thread] = _time.monotonic()
+    
+    def advance(self) -> None:
+        """Jump to the earliest wake time if every other thread is sleeping or idle."""
+        real = _time.monotonic()
+        if any(real - since < self.GRACE for since in self.running.values()):
+            return
+        earliest = min(self.sleepers.values())
+        if earliest > self.now:
+            self.now = earliest
+            self.condition.notify_all()
+
+# MARK: Simulated GPIO
+class SimPWM:
+    def __init__(self, gpio, pin: int, frequency: float) -> None:
+        self.gpio = gpio
+        self.pin = pin
+        self.frequency = frequency
+        self.duty_cycle = 0.0
+        self.running = False
+    
+    def start(self, duty_cycle: float) -> None:
+        self.running = True
+        self.ChangeDutyCycle(duty_cycle)
+    
+    def ChangeDutyCycle(self, duty_cycle: float) -> None:
+        self.duty_cycle = duty_cycle
+        self.gpio.log("pwm", self.pin, duty_cycle)
+    
+    def ChangeFrequency(self, frequency: float) -> None:
+        self.frequency = frequency
+    
+    def stop(self) -> None:
+        self.running = False
+        self.duty_cycle = 0.0
+        self.gpio.log("pwm", self.pin, 0.0)
+
+class SimGPIO:
+    """
+    Stand-in for RPi.GPIO that keeps the pin states and an optional event log.
+    """
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    
+    def __init__(self, clock: Clock, keep_log: bool = False) -> None:
+        self.clock = clock
+        self.keep_log = keep_log
+        self.mode = None
+        self.pins: dict[int, int] = {}
+        self.events: list[tuple[float, str, int, float]] = []
+        self.lock = threading.Lock()
+    
+    def log(self, kind: str, pin: int, value: float) -> None:
+        if self.keep_log:
+            with self.lock:
+                self.events.append((self.clock.monotonic(), kind, pin, value))
+    
+    def setmode(self, mode) -> None:
+        self.mode = mode
+    
+    def setwarnings(self, flag: bool) -> None:
+        pass
+    
+    def setup(self, pin: int, direction, initial = LOW) -> None:
+        self.pins[pin] = initial
+    
+    def output(self, pin: int, value) -> None:
+        self.pins[pin] = int(bool(value))
+        self.log("output", pin, self.pins[pin])
+    
+    def input(self, pin: int) -> int:
+        return self.pins.get(pin, self.LOW)
+    
+    def PWM(self, pin: int, frequency: float) -> SimPWM:
+        return SimPWM(self, pin, frequency)
+    
+    def cleanup(self, *pins) -> None:
+        for pin in pins or list(self.pins):
+            self.pins[pin] = self.LOW
+
+# MARK: Simulated ADC
+class SimADS1115:
+    """
+    Stand-in for Adafruit_ADS1x15.ADS1115, readings are noisy around a value per channel.
+    """
+    def __init__(self, address: int = 0x48, busnum: int = 1, values = (16000, 16000, 16000, 16000), noise: float = 200) -> None:
+        self.address = address
+        self.busnum = busnum
+        self.values: list[float] = list(values)
+        self.noise: float = noise
+        self.continuous_channel: int | None = None
+    
+    def sample(self, channel: int) -> int:
+        value = random.gauss(self.values[channel], self.noise)
+        return int(min(max(value, -32768), 32767))
+    
+    def read_adc(self, channel: int, gain: int = 1, data_rate = None) -> int:
+        # A single-shot conversion takes one sample period (128 samples/s by default)
+        clock.sleep(1 / (data_rate or 128))
+        return self.sample(channel)
+    
+    def start_adc(self, channel: int, gain: int = 1, data_rate = None) -> int:
+        self.continuous_channel = channel
+        clock.sleep(1 / (data_rate or 128))
+        return self.sample(channel)
+    
+    def get_last_result(self) -> int:
+        return self.sample(self.continuous_channel or 0)
+    
+    def stop_adc(self) -> None:
+        self.continuous_channel = None
+
+# MARK: Simulated HTTP
+class SimResponse:
+    def __init__(self, status_code: int = 200, data = None) -> None:
+        self.status_code = status_code
+        self.data = data
+        self.text = "" if data is None else json.dumps(data)
+    
+    def json(self):
+        if self.data is None:
+            raise ValueError("No json in response")
+        return self.data
+
+class SimSession:
+    """
+    Stand-in for requests.Session, answers OpenWeatherMap and Blynk without the network.
+    """
+    def __init__(self, clock: Clock, seed: int = 0) -> None:
+        self.clock = clock
+        self.random = random.Random(seed)
+    
+    def mount(self, prefix: str, adapter) -> None:
+        pass
+    
+    def close(self) -> None:
+        pass
+    
+    def weather(self) -> dict:
+        return {
+            "name": "Simulation",
+            "weather": [{"main": "Clouds", "description": "simulated clouds"}],
+            "main": {"temp": round(self.random.uniform(24, 34), 1), "humidity": self.random.randint(55, 90)},
+            "wind": {"speed": round(self.random.uniform(0, 6), 1)},
+        }
+    
+    def forecast(self) -> dict:
+        slot = 3 * 3600
+        first = (int(self.clock.time()) // slot + 1) * slot
+        entries = []
+        for i in range(40):
+            entry = {"dt": first + i * slot, "main": {"temp": round(self.random.uniform(22, 34), 1), "humidity": self.random.randint(50, 95)}}
+            if self.random.random() < 0.3:
+                entry["rain"] = {"3h": round(self.random.uniform(0.1, 4), 2)}
+            entries.append(entry)
+        return {"list": entries}
+    
+    def get(self, url: str, params = None, timeout = None, **kwargs) -> SimResponse:
+        if url.endswith("/weather"):
+            return SimResponse(200, self.weather())
+        if url.endswith("/forecast"):
+            return SimResponse(200, self.forecast())
+        return SimResponse(200)  # Blynk updates
+    
+    def request(self, method: str, url: str, **kwargs) -> SimResponse:
+        return self.get(url, **kwargs)
+
+# MARK: Backend
+if BACKEND == "sim":
+    clock: Clock = VirtualClock()
+    GPIO = SimGPIO(clock)
+    ADS1115 = SimADS1115
+else:
+    clock: Clock = Clock()
+    import RPi.GPIO as GPIO
+    from Adafruit_ADS1x15 import ADS1115
+
+sleep = clock.sleep
+
+def create_session():
+    """
+    Return the HTTP session of the backend, a requests.Session or a SimSession.
+    """
+    if BACKEND == "sim":
+        return SimSession(clock)
+    import requests
+    return requests.Session()
+
+def create_camera(hsv_file: str = "config/hsv.json"):
+    """
+    Return the camera of the backend, a Picamera2 or a synthetic frame camera.
+    """
+    if BACKEND == "sim":
+        from replay_benchmark import ReplayCamera, synthetic_frames
+        return ReplayCamera(synthetic_frames(hsv_file))
+    from picamera2 import Picamera2
+    return Picamera2()
@@ -0,0 +1,154 @@
+# image_archive.py
+"""
+    Code that archives captured frames in the background
+    
+    Queues frames to a writer thread so saving never stalls detection
+    -> encodes frames as JPEG (quality) or PNG (compression level)
+    -> writes them to the archive folder
+    -> keeps the folder inside a size and age budget by removing the oldest images
+    eg: archiver = ImageArchiver("captured_images")
+        archiver.save(frame, "stop_1")
+"""
+
+import os
+import cv2
+import queue
+import threading
+from time import time
+from collections import deque
+
+class ImageArchiver:
+    # MARK: init
+    def __init__(self, folder : str = "captured_images", image_format : str = "jpg",
+                 jpeg_quality : int = 90, png_level : int = 3,
+                 max_bytes : int = 500 * 1024 * 1024, max_age : float = 7 * 24 * 3600,
+                 queue_size : int = 8) -> None:
+        """
+        :param image_format: "jpg" or "png"
+        :param jpeg_quality: JPEG quality (0-100)
+        :param png_level: PNG compression level (0-9)
+        :param max_bytes: Size budget of the folder in bytes, 0 for no limit
+        :param max_age: Maximum age of an image in seconds, 0 for no limit
+        :param queue_size: Frames waiting to be written before new ones are dropped
+        """
+        self.folder : str = folder
+        self.image_format : str = image_format.lower().lstrip(".")
+        self.jpeg_quality : int = jpeg_quality
+        self.png_level : int = png_level
+        self.max_bytes : int = max_bytes
+        self.max_age : float = max_age
+        
+        self.saved : int = 0
+        self.dropped : int = 0
+        self.removed : int = 0
+        
+        os.makedirs(self.folder, exist_ok=True)
+        
+        # Archived images oldest first as (mtime, path, size)
+        self.files : deque = deque()
+        self.total_bytes : int = 0
+        self.scan_folder()
+        
+        self.queue : queue.Queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self.writer_loop, daemon=True)
+        self.thread.start()
+    
+    # MARK: Scan Folder
+    def scan_folder(self) -> None:
+        """
+        Collect the images already in the folder so they count towards the budget.
+        """
+        files = []
+        for file_name in os.listdir(self.folder):
+            if not file_name.lower().endswith((".png", ".jpg", ".jpeg")):
+                continue
+            file_path = os.path.join(self.folder, file_name)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, file_path, stat.st_size))
+        files.sort()
+        self.files = deque(files)
+        self.total_bytes = sum(size for _, _, size in files)
+    
+    # MARK: Encode Params
+    def encode_params(self) -> list[int]:
+        if self.image_format == "png":
+            return [cv2.IMWRITE_PNG_COMPRESSION, self.png_level]
+        return [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+    
+    # MARK: Save
+    def save(self, frame, prefix : str = "captured_frame") -> bool:
+        """
+        Queue a frame to be archived, returns False if the queue was full and it was dropped.
+        """
+        try:
+            self.queue.put_nowait((frame, prefix, time()))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            print("\033[31mArchive queue full, frame dropped\033[0m")
+            return False
+    
+    # MARK: Writer Loop
+    def writer_loop(self) -> None:
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self.write(*item)
+            except Exception as e:
+                print(f"\033[31mError archiving image: {e}\033[0m")
+            finally:
+                self.queue.task_done()
+    
+    # MARK: Write
+    def write(self, frame, prefix : str, timestamp : float) -> None:
+        extension = "png" if self.image_format == "png" else "jpg"
+        filename = os.path.join(self.folder, f"{prefix}_{int(timestamp * 1000)}.{extension}")
+        
+        success, encoded = cv2.imencode(f".{extension}", frame, self.encode_params())
+        if not success:
+            print(f"\033[31mError encoding {filename}\033[0m")
+            return
+        with open(filename, "wb") as file:
+            file.write(encoded.tobytes())
+        
+        self.files.append((timestamp, filename, encoded.size))
+        self.total_bytes += encoded.size
+        self.saved += 1
+        print(f"Image saved as {filename}")
+        
+        self.enforce_budget()
+    
+    # MARK: Enforce Budget
+    def enforce_budget(self) -> None:
+        """
+        Remove the oldest images until the folder is inside its size and age budget.
+        """
+        now = time()
+        while self.files:
+            mtime, file_path, size = self.files[0]
+            over_size = self.max_bytes and self.total_bytes > self.max_bytes
+            over_age = self.max_age and now - mtime > self.max_age
+            if not (over_size or over_age):
+                break
+            self.files.popleft()
+            self.total_bytes -= size
+            try:
+                os.remove(file_path)
+                self.removed += 1
+            except OSError as e:
+                print(f"\033[31mError removing {file_path}: {e}\033[0m")
+    
+    # MARK: Close
+    def close(self, timeout : float = 5.0) -> None:
+        """
+        Write the queued frames and stop the writer thread.
+        """
+        if not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join(timeout)
@@ -8,9 +8,9 @@
     
     Gets Moisture from moisture.py
     -> lowers the moisture sensor to get moisture value
-    -> gets the moisture value
+    -> gets the moisture value of every probe
     -> raises the moisture sensor
-    eg: moisture_value = get_moisture()
+    eg: moisture_value = measure_moisture()["moisture"]
     
     Gets Weather from weather.py
     -> Gets Temperature using get_weather function
@@ -50,26 +50,86 @@
     # TODO: Manual Control of the Rover using ESP or transmitter and receiver
 """
 
-from rover_L298N import read_csv, execute_line
-from moisture_sensor import get_moisture
+from time import perf_counter
+IMPORT_START = perf_counter()
+
+from rover_L298N import load_plan, execute_line
+from moisture_sensor import measure_moisture
 from sensor_movement import move_up, move_down, stop_motor
-from weather_data import get_weather, get_rain_forecast
-from plant_camera import camera
-from water_pump import water
-from blynk_api import send_data_to_blynk
+from weather_data import get_weather, get_forecast, DEFAULT_RAIN
+from water_pump import dose_water, FLOW_RATE
+from blynk_api import uploader as blynk_uploader
+from water_planner import WaterPlanner
+import metrics
+from metrics import stage, timed
 
-import cv2
+import os
+import csv
 import json
-from time import sleep
-import RPi.GPIO as GPIO
+import threading
+from datetime import datetime
+from hardware import GPIO, clock
 import concurrent.futures
 
-def camera_work():
+# cv2, picamera2 and the templates are only loaded when the camera is first used
+print(f"\033[32mImports took {(perf_counter() - IMPORT_START) * 1000:.0f} ms\033[0m")
+
+# Run without OpenCV windows when no display is attached (unattended rovers)
+HEADLESS: bool = not os.environ.get("DISPLAY")
+
+# Archive the frame of every stop in the background
+ARCHIVE_STOPS: bool = True # TODO: Change
+
+# Readings of every stop are appended here
+MISSION_LOG: str = "mission_log.csv"
+
+# Water model coefficients, shared by get_water_needed and batch planning
+water_planner = WaterPlanner(
+    decay=(0.25, 0.5, 0.75, 1.0),  # Time decay factors for rainfall # TODO: Change
+    moisture_factor=0.5,           # Adjust this value based on soil type # TODO: Change
+    temp_factor=1.0,               # Temperature contribution factor # TODO: Change
+    humidity_factor=0.5,           # Humidity contribution factor # TODO: Change
+)
+
+# Millilitres dosed per unit of water needed (the model was tuned in seconds of pumping at full duty) # TODO: Calibrate
+ML_PER_WATER_UNIT: float = FLOW_RATE
+
+# PlantCam, created by get_camera on first use
+camera = None
+camera_lock = threading.Lock()
+
+def get_camera():
+    """Start the camera and load the species data the first time it is needed."""
+    global camera
+    with camera_lock:
+        if camera is None:
+            start = perf_counter()
+            from plant_camera import PlantCam
+            camera = PlantCam(headless=HEADLESS)
+            print(f"\033[32mCamera ready in {(perf_counter() - start) * 1000:.0f} ms\033[0m")
+    return camera
+
+def camera_work(headless: bool = HEADLESS, show_result: bool = False, stop: int | None = None):
+    """
+    Capture a frame and detect the species and water content of the leaf.
+    
+    Headless runs return as soon as detection is done. Otherwise the annotated
+    frame is shown and, if show_result is set, held until a key is pressed.
+    With ARCHIVE_STOPS the raw frame is queued for archival, named after the stop.
+    """
+    camera = get_camera()
+    
+    # A new stop means a new plant, do not search around the last leaf
+    camera.reset_tracking()
+    
     # Capture a frame from the camera
-    frame = camera.camera.capture_array()
+    frame, lores = camera.capture()
+    
+    # Detect species and water content without drawing anything
+    result = camera.detect(frame, lores)
     
-    # Process the frame to detect species and water content
-    processed_frame = camera.process_frame(frame)
+    if ARCHIVE_STOPS:
+        camera.save_image(frame, "captured_frame" if stop is None else f"stop_{stop}")
     
     # Display processed results if desired
     print(f"Detected Species: {camera.species}")
@@ -77,68 +137,69 @@ def camera_work():
     print(f"Water Content: {camera.water_content:.2f}%")
     print(f"Water Needed: {camera.water_content_needed:.2f}%")
     
-    # Optionally display the frame with annotations
-    cv2.imshow("Processed Frame", processed_frame)
-    cv2.waitKey(0)  # Wait for a key press to close the window
+    if not headless:
+        import cv2
+        # Optionally display the frame with annotations
+        cv2.imshow("Processed Frame", camera.render(result))
+        cv2.waitKey(0 if show_result else 1)  # 0 waits for a key press to close the window
     
     return camera.species, camera.water_content, camera.water_content_needed
 
-def load_species_water_content(self):
+def load_species_water_content():
     # Load species water content from JSON file
     with open("config/water_needed.json", "r") as file:
         species_water_content = json.load(file)
         file.close()
     return species_water_content
 
-# Calculate weight factors based on temperature and humidity
-def calculate_weight(temp: int, humid: int, time_decay: float, rain: int):
-    return max(0, 1 - (temp * time_decay / (humid + 1))) * rain
-
 # MARK: water needed
-def get_water_needed(species: str, moisture_value, temperature, humidity, rain_3h, rain_6h, rain_9h, rain_12h, water_content, water_content_needed, species_water_content):
-    # Calculate water needed for the plant
-    S = species_water_content[species]
-    
-    # Time decay factors for rainfall
-    t_3h, t_6h, t_9h, t_12h = 0.25, 0.5, 0.75, 1.0  # TODO: Change
-    
-    # Weight factors
-    w_3h = calculate_weight(temperature, humidity, t_3h, rain_3h)
-    w_6h = calculate_weight(temperature, humidity, t_6h, rain_6h)
-    w_9h = calculate_weight(temperature, humidity, t_9h, rain_9h)
-    w_12h = calculate_weight(temperature, humidity, t_12h, rain_12h)
-    
-    # Calculate effective rainfall contribution (R)
-    R = w_3h + w_6h + w_9h + w_12h  # Total rainfall
-    
-    # Soil moisture adjustment (M)
-    moisture_factor = 0.5  # Adjust this value based on soil type # TODO: Change
-    M = moisture_value * moisture_factor
-    
-    # Evapotranspiration adjustment (E)
-    temp_factor = 1.0  # Temperature contribution factor  # TODO: Change
-    humidity_factor = 0.5  # Humidity contribution factor # TODO: Change
-    
-    E = (temperature * temp_factor) - (humidity * humidity_factor)
-    
-    # Calculate total water needed
-    water_needed = S - (R + M) + E
-    
-    # Ensure water needed is non-negative
-    water_needed_calculated = max(0, water_needed)
-    water_needed_calculated = round(water_needed_calculated, 2)
+def get_water_needed(species: str, moisture_value, temperature, humidity, rain_3h, rain_6h, rain_9h, rain_12h, water_content, water_content_needed, species_water_content, wind_speed = 0.0):
+    # Calculate water needed for the plant with the same model the batch planner uses
+    water_needed_calculated = float(water_planner.plan(
+        species=species,
+        moisture=moisture_value,
+        water_content=water_content or 0.0,
+        species_water_content=species_water_content,
+        temperature=temperature,
+        humidity=humidity,
+        wind_speed=wind_speed,
+        rain=(rain_3h, rain_6h, rain_9h, rain_12h),
+    ))
     
     print(f"Water Needed: {water_needed_calculated}%")
     
     return water_needed_calculated
 
+# MARK: Mission log
+def log_stop(stop: int, moisture_value, species, water_content, water_needed, readings = None):
+    """Append the readings of a stop to the mission log, with the moisture of every probe."""
+    probes = "" if readings is None else json.dumps({int(channel): float(value) for channel, value in zip(readings["channel"], readings["moisture"])})
+    new_file = not os.path.exists(MISSION_LOG)
+    with open(MISSION_LOG, "a", newline="") as file:
+        writer = csv.writer(file)
+        if new_file:
+            writer.writerow(["time", "stop", "moisture", "species", "water_content", "water_needed", "probes"])
+        writer.writerow([datetime.now().isoformat(timespec="seconds"), stop, moisture_value, species, water_content, water_needed, probes])
+
+def report_background_error(future):
+    """Print the error of a finished background task, returns False so it can be dropped."""
+    error = future.exception()
+    if error is not None:
+        print(f"\033[31mBackground task failed: {error}\033[0m")
+    return False
+
 # MARK: main
 def main():
-    file_content = read_csv()
+    # Compile and validate the whole route before moving
+    plan = load_plan()
     
-    # Using weather API
-    temperature, humidity, wind_speed, weather = get_weather()
-    rain_3h, rain_6h, rain_9h, rain_12h = get_rain_forecast()
+    # Upload readings buffered while the last mission was out of range
+    blynk_uploader.start()
+    
+    # Serve stage latencies and HTTP errors for the whole mission
+    metrics.registry.start_exporter()
+    
+    mission_start = clock.monotonic()
     
     species_water_content = load_species_water_content()
     
@@ -153,23 +214,76 @@ def main():
     #     moisture_value = read_sensor()
     #     move_down()
 
-    for i in range(1, len(file_content)):
-        execute_line(i)
+    # One pool for the parked work at every stop, one ordered worker for work that
+    # does not need the rover parked and can overlap the drive to the next stop
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3, thread_name_prefix="parked") as parked_pool, \
+         concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="background") as background_pool:
+        background = []
+        
+        # Start the camera and use the weather API while the rover drives to the first stop
+        background.append(parked_pool.submit(get_camera))
+        weather_future = parked_pool.submit(get_weather)
+        rain_future = parked_pool.submit(get_forecast)
+        forecast = None
         
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            result1 = executor.submit(get_moisture)
-            result2 = executor.submit(camera_work)
+        for i in range(1, len(plan) + 1):
+            with stage("execute_line"):
+                execute_line(i, plan)
+            
+            if weather_future is not None:
+                temperature, humidity, wind_speed, weather = weather_future.result()
+                weather_future = None
+            
+            # The forecast is waited for at the first stop only, later refreshes never block
+            if rain_future is not None and (i == 1 or rain_future.done()):
+                forecast = rain_future.result() or forecast
+                rain_future = None
             
-            moisture_value = result1.result()
+            # Rain expected from the arrival at this stop, without refetching the forecast
+            if forecast is not None and len(forecast):
+                rain_3h, rain_6h, rain_9h, rain_12h = forecast.rain_slots(clock.time(), 4)
+            else:
+                print(f"\033[31mNo weather forecast, using {DEFAULT_RAIN} and retrying in the background\033[0m")
+                rain_3h, rain_6h, rain_9h, rain_12h = DEFAULT_RAIN
+                if rain_future is None:
+                    rain_future = parked_pool.submit(get_forecast)
+            
+            result1 = parked_pool.submit(timed("get_moisture", measure_moisture))
+            result2 = parked_pool.submit(timed("camera_work", camera_work), stop=i)
+            
+            # Mean of every probe on the arm, the per-channel readings go to the mission log
+            moisture = result1.result()
+            moisture_value, readings = (None, None) if moisture is None else (moisture["moisture"], moisture["readings"])
             species, water_content, water_content_needed = result2.result()
+            
+            try:
+                with stage("get_water_needed"):
+                    water_needed_calculated = get_water_needed(species, moisture_value, temperature, humidity, rain_3h, rain_6h, rain_9h, rain_12h, water_content, water_content_needed, species_water_content, wind_speed)
+            except (ValueError, KeyError) as e:
+                # Do not water on a failed reading, the readings are still uploaded and logged
+                print(f"\033[31mSkipping watering at stop {i}, no valid reading: {e}\033[0m")
+                water_needed_calculated = None
+            
+            # Using water pump, the dose runs on its own timer while the readings are queued
+            water_start = clock.monotonic()
+            dose = None if water_needed_calculated is None else dose_water(water_needed_calculated * ML_PER_WATER_UNIT)
+            
+            # Using Blynk (queued to its uploader) and the mission log while the rover drives on,
+            # missing values (None) leave their pin out
+            blynk_uploader.send(moisture_value, species, water_content, water_needed_calculated)
+            background.append(background_pool.submit(log_stop, i, moisture_value, species, water_content, water_needed_calculated, readings))
+            background = [future for future in background if not future.done() or report_background_error(future)]
+            
+            # Stay parked until the plant got its water
+            if dose is not None:
+                dose.wait()
+                metrics.record_stage("water", clock.monotonic() - water_start)
         
-        water_needed_calculated = get_water_needed(species, moisture_value, temperature, humidity, rain_3h, rain_6h, rain_9h, rain_12h, water_content, water_content_needed, species_water_content)
-        
-        # Using water pump
-        water(water_needed_calculated)
-        
-        # Using Blynk
-        send_data_to_blynk(moisture_value, species, water_content, water_needed_calculated)
+        print("Waiting for background work to finish...")
+        for future in concurrent.futures.as_completed(background):
+            report_background_error(future)
+    
+    print(f"\033[32mMission finished in {clock.monotonic() - mission_start:.1f} seconds\033[0m")
 
 if __name__ == "__main__":
     try:
@@ -179,5 +293,8 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"Error in main file: {e}")
     finally:
+        blynk_uploader.close()
+        if camera is not None:
+            camera.archiver.close()
         GPIO.cleanup()
         print("Program ended")
@@ -0,0 +1,206 @@
+# metrics.py
+"""
+    Code that collects mission metrics and serves them over HTTP
+
+    Counters and latency histograms kept in one registry
+    -> every stage of main.main is timed into plantpulse_stage_seconds{stage="..."}
+    -> failing stages are counted in plantpulse_stage_errors_total
+    -> failed HTTP requests to OpenWeatherMap and Blynk are counted in plantpulse_http_errors_total
+    eg: with stage("execute_line"):
+            execute_line(i, plan)
+        http_error("blynk", 503)
+
+    start_exporter serves the registry in the Prometheus text format on
+    http://METRICS_ADDRESS:METRICS_PORT/metrics from a background thread
+    eg: curl http://localhost:9108/metrics
+"""
+
+import os
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from hardware import clock
+
+METRICS_ADDRESS: str = os.environ.get("PLANTPULSE_METRICS_ADDRESS", "127.0.0.1")
+METRICS_PORT: int = int(os.environ.get("PLANTPULSE_METRICS_PORT", "9108"))  # 0 disables the exporter
+
+# Seconds, from a quick HTTP request up to a long watering
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+def label_key(labels: dict) -> tuple[tuple[str, str], ...]:
+    return tuple(sorted((name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in labels.items()))
+
+# MARK: Metrics
+class Counter:
+    """
+    Monotonic count per label set.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name: str = name
+        self.help: str = help
+        self.values: dict[tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{format_labels(key)} {value:g}" for key, value in values.items()]
+
+class Histogram:
+    """
+    Cumulative bucket counts, sum and count of observed values per label set.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets = DEFAULT_BUCKETS) -> None:
+        self.name: str = name
+        self.help: str = help
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+        # label set -> [counts per bucket (+Inf last), sum]
+        self.values: dict[tuple, list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self.values[key] = [counts, total + value]
+
+    def render(self) -> list[str]:
+        with self.lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+        lines = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {total:g}")
+            lines.append(f"{self.name}_count{format_labels(key)} {cumulative}")
+        return lines
+
+# MARK: Registry
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: dict[str, Counter | Histogram] = {}
+        self.lock = threading.Lock()
+        self.server: ThreadingHTTPServer | None = None
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.register(Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    # MARK: Exporter
+    def start_exporter(self, port: int = METRICS_PORT, address: str = METRICS_ADDRESS):
+        """Serve /metrics from a background thread, does nothing if already serving or port is 0."""
+        if self.server is not None or not port:
+            return self.server
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes would flood the mission output
+
+        try:
+            self.server = ThreadingHTTPServer((address, port), Handler)
+        except OSError as e:
+            print(f"\033[31mError: Unable to start the metrics exporter on port {port}: {e}\033[0m")
+            return None
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        print(f"\033[32mMetrics on http://{address}:{port}/metrics\033[0m")
+        return self.server
+
+    def stop_exporter(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram("plantpulse_stage_seconds", "Latency of the mission stages in seconds")
+STAGE_ERRORS = registry.counter("plantpulse_stage_errors_total", "Mission stages that raised an error")
+HTTP_ERRORS = registry.counter("plantpulse_http_errors_total", "Failed HTTP requests by service and reason")
+
+# MARK: Helpers
+class stage:
+    """
+    Time the enclosed block (or a call) as a mission stage, on the hardware clock
+    so simulated missions report simulated durations.
+    eg: with stage("water"): ...
+    """
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock.monotonic()
+        return self
+
+    def __exit__(self, exc_type, *exc) -> bool:
+        STAGE_SECONDS.observe(clock.monotonic() - self.start, stage=self.name)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(stage=self.name)
+        return False
+
+def timed(name: str, function):
+    """Wrap function so every call is timed as stage name, for pools and callbacks."""
+    def wrapper(*args, **kwargs):
+        with stage(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+def record_stage(name: str, seconds: float) -> None:
+    """Record a stage measured elsewhere (e.g. work that overlaps other stages)."""
+    STAGE_SECONDS.observe(seconds, stage=name)
+
+def http_error(service: str, reason) -> None:
+    """Count a failed request, reason is a status code or an exception."""
+    if isinstance(reason, BaseException):
+        reason = type(reason).__name__
+    HTTP_ERRORS.inc(service=service, reason=reason)
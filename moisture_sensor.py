@@ -4,17 +4,55 @@
     -> lowers the moisture sensor to get moisture value
     -> gets the moisture value using ADS1115 ADC
     -> raises the moisture sensor
+    
+    Burst sampling streams continuous conversions at DATA_RATE into a small window
+    -> filtered with a trimmed mean
+    -> the settle phase ends as soon as the filtered readings of the last SETTLE_SPAN seconds
+       drift by less than SETTLE_TOLERANCE (least squares slope), their mean is the reading
+    eg: moisture_value, settle_time = sample_moisture()
+    
+    Several probes on the arm are read in one sweep of the CHANNELS
+    -> one reading per channel with the time it was taken
+    eg: readings, settle_time = sample_channels((0, 1, 2, 3))
+        readings["moisture"], readings["time"]
 """
 
 # Functions to move sensor
 from sensor_movement import move_up, move_down, stop_motor
 
-import RPi.GPIO as GPIO
-import Adafruit_ADS1x15
-from time import sleep
+import threading
+import numpy as np
+from hardware import GPIO, ADS1115, clock, sleep
+
+# ADS1115 ADC on bus 1, initialized by get_adc on first use
+adc = None
+adc_lock = threading.Lock()
+
+# Burst sampling
+DATA_RATE: int = 860               # Samples per second (ADS1115: 8 to 860)
+WINDOW: int = 16                   # Samples per filtered reading
+TRIM: float = 0.25                 # Fraction dropped at each end before averaging
+SETTLE_TOLERANCE: float = 0.5      # Moisture % the reading may drift over SETTLE_SPAN # TODO: Change
+SETTLE_SPAN: float = 0.5           # Seconds of readings the drift is measured over # TODO: Change
 
-# Initialize the ADS1115 ADC on bus 1
-adc = Adafruit_ADS1x15.ADS1115(address=0x48, busnum=1)
+# Channels with a moisture probe, all read at every stop # TODO: Change
+CHANNELS: tuple[int, ...] = (0,)
+
+# One reading of a channel
+READING_DTYPE = np.dtype([("channel", np.uint8), ("moisture", np.float64), ("time", np.float64)])
+
+# Settle time used by the last get_moisture
+last_settle_time: float = 0.0
+
+# MARK: ADC
+def get_adc():
+    """Return the ADS1115, initializing it the first time."""
+    global adc
+    if adc is None:
+        with adc_lock:
+            if adc is None:
+                adc = ADS1115(address=0x48, busnum=1)
+    return adc
 
 # MARK: Read Sensor
 def read_sensor(channel: int = 0, GAIN: int = 1):
@@ -27,29 +65,137 @@ def read_sensor(channel: int = 0, GAIN: int = 1):
     It will be between 0 and 32767
     """
     
-    value = adc.read_adc(channel, gain=GAIN)
+    value = get_adc().read_adc(channel, gain=GAIN)
     value = (value/32767) * 100
     value = round(value, 2)
     return value
 
+# MARK: Burst Sampling
+def trimmed_mean(values: np.ndarray, trim: float = TRIM) -> float:
+    """Mean without the lowest and highest trim fraction of the values."""
+    values = np.sort(values)
+    cut = int(len(values) * trim)
+    return float(values[cut:len(values) - cut].mean())
+
+def settled_value(times: list[float], values: list, tolerance: float = SETTLE_TOLERANCE, span: float = SETTLE_SPAN):
+    """
+    Mean of the filtered readings of the last span seconds once their fitted drift
+    over span is within tolerance (for every channel), else None.
+    Drops readings older than span from times and values.
+    """
+    while len(times) > 1 and times[-1] - times[1] >= span:
+        del times[0], values[0]
+    if len(times) < 3 or times[-1] - times[0] < span:
+        return None
+    t = np.asarray(times) - times[0]
+    v = np.asarray(values, dtype=np.float64)
+    slope = np.polyfit(t, v, 1)[0]
+    if np.all(np.abs(slope) * span <= tolerance):
+        return v.mean(axis=0)
+    return None
+
+def sample_moisture(channel: int = 0, GAIN: int = 1, max_settle: float = 2, tolerance: float = SETTLE_TOLERANCE):
+    """
+    Stream continuous conversions until the filtered reading stops drifting.
+    :param max_settle: Longest time to wait for the reading to settle
+    :return: (moisture value in percentage, seconds it took to settle)
+    """
+    adc = get_adc()
+    window = np.empty(WINDOW, dtype=np.float64)
+    times, values = [], []
+    period = 1 / DATA_RATE
+    
+    start_time = clock.monotonic()
+    adc.start_adc(channel, gain=GAIN, data_rate=DATA_RATE)
+    try:
+        while True:
+            for i in range(WINDOW):
+                sleep(period)
+                window[i] = adc.get_last_result()
+            value = trimmed_mean(window) / 32767 * 100
+            elapsed = clock.monotonic() - start_time
+            times.append(elapsed)
+            values.append(value)
+            
+            settled = settled_value(times, values, tolerance)
+            if settled is not None:
+                return round(float(settled), 2), elapsed
+            # Never run a window past max_settle
+            if elapsed + WINDOW * period > max_settle:
+                return round(value, 2), elapsed
+    finally:
+        adc.stop_adc()
+
+# MARK: Multi-channel
+def sweep_channels(channels = CHANNELS, GAIN: int = 1, samples: int = WINDOW) -> np.ndarray:
+    """
+    Read every channel in one scheduled sweep, samples single-shot conversions at
+    DATA_RATE per channel filtered with a trimmed mean.
+    :return: Array of READING_DTYPE, one reading per channel
+    """
+    adc = get_adc()
+    readings = np.empty(len(channels), dtype=READING_DTYPE)
+    window = np.empty(samples, dtype=np.float64)
+    for i, channel in enumerate(channels):
+        start_time = clock.time()
+        for j in range(samples):
+            window[j] = adc.read_adc(channel, gain=GAIN, data_rate=DATA_RATE)
+        readings[i] = (channel, round(trimmed_mean(window) / 32767 * 100, 2), (start_time + clock.time()) / 2)
+    return readings
+
+def sample_channels(channels = CHANNELS, GAIN: int = 1, max_settle: float = 2, tolerance: float = SETTLE_TOLERANCE):
+    """
+    Sweep the channels until the readings of every channel stop drifting.
+    A single channel uses continuous conversion (sample_moisture).
+    :return: (array of READING_DTYPE, seconds it took to settle)
+    """
+    if len(channels) == 1:
+        moisture_value, settle_time = sample_moisture(channels[0], GAIN, max_settle, tolerance)
+        return np.array([(channels[0], moisture_value, clock.time())], dtype=READING_DTYPE), settle_time
+    
+    times, values = [], []
+    start_time = clock.monotonic()
+    elapsed = 0.0
+    while True:
+        readings = sweep_channels(channels, GAIN)
+        sweep_time = clock.monotonic() - start_time - elapsed
+        elapsed += sweep_time
+        times.append(elapsed)
+        values.append(readings["moisture"].copy())
+        
+        settled = settled_value(times, values, tolerance)
+        if settled is not None:
+            readings["moisture"] = np.round(settled, 2)
+            return readings, elapsed
+        # Never run a sweep past max_settle
+        if elapsed + sweep_time > max_settle:
+            return readings, elapsed
+
 # MARK: Get Moisture
-def get_moisture(moisture_duration: int= 2, movement_duration: int= 2, speed: int= 100):
+def measure_moisture(moisture_duration: int= 2, movement_duration: int= 2, speed: int= 100, channels = CHANNELS):
+    """
+    Lower the sensor, read every probe once the readings settled (at most moisture_duration seconds) and raise it.
+    :return: dict with the mean moisture, the per-channel readings and the settle time, None on errors
+    """
+    global last_settle_time
     try:
         # Lower the sensor
         print("Lowering the sensor...")
         move_down(movement_duration, speed)
         
         # Measure the moisture
-        print(f"Waiting for {moisture_duration} seconds to settle moisture sensor...")
-        sleep(moisture_duration)
-        moisture_value = read_sensor()
-        print(f"Moisture Value: {moisture_value}")
+        print(f"Waiting up to {moisture_duration} seconds to settle moisture sensor...")
+        readings, last_settle_time = sample_channels(channels, max_settle=moisture_duration)
+        moisture_value = round(float(readings["moisture"].mean()), 2)
+        print(f"Moisture Value: {moisture_value} (settled in {last_settle_time:.2f} seconds)")
+        if len(readings) > 1:
+            print("Moisture per channel: " + ", ".join(f"{channel}: {value}" for channel, value in zip(readings["channel"], readings["moisture"])))
         
         # Raise the sensor
         print("Raising the sensor...")
         move_up(movement_duration, speed)
         
-        return moisture_value
+        return {"moisture": moisture_value, "readings": readings, "settle_time": last_settle_time}
     
     except Exception as e:
         print(f"\n\033[31mAn error occurred: {e}\033[0m")
@@ -59,6 +205,11 @@ def get_moisture(moisture_duration: int= 2, movement_duration: int= 2, speed: in
         print("\033[32mStopping the motors...\033[0m")
         stop_motor()
 
+def get_moisture(moisture_duration: int= 2, movement_duration: int= 2, speed: int= 100):
+    """Mean moisture of all probes, see measure_moisture."""
+    result = measure_moisture(moisture_duration, movement_duration, speed)
+    return None if result is None else result["moisture"]
+
 if __name__ == "__main__":
     try:
         while True:
@@ -0,0 +1,153 @@
+# motion_controller.py
+"""
+    Code that runs the motors without blocking the caller
+
+    Every motor command is a timed command: start the motor now, stop it after a duration
+    -> scheduled on one asyncio event loop running on a background thread
+    -> returns a MotionHandle that can be awaited, waited for (result) or cancelled
+    -> commands on the same actuator run one after the other,
+       commands on different actuators (rover, sensor arm) run at the same time
+    eg: arrive = controller.step(plan[0])
+        lower = controller.sensor("down", 2, after=arrive)
+        lower.result()
+
+    Durations use the clock of hardware.py, so the sim backend runs them faster too
+"""
+
+import asyncio
+import threading
+import concurrent.futures
+from hardware import clock
+import rover_L298N
+import sensor_movement
+
+class MotionHandle:
+    """
+    Handle of a scheduled command, awaitable from any event loop.
+    """
+    def __init__(self, future: concurrent.futures.Future, actuator: str, action: str, duration: float) -> None:
+        self.future = future
+        self.actuator: str = actuator
+        self.action: str = action
+        self.duration: float = duration
+
+    def __await__(self):
+        return asyncio.wrap_future(self.future).__await__()
+
+    def __repr__(self) -> str:
+        return f"MotionHandle({self.actuator}: {self.action} {self.duration}s, done={self.done()})"
+
+    def result(self, timeout: float | None = None) -> bool:
+        """Block until the command finished, True if it ran to the end."""
+        try:
+            return self.future.result(timeout)
+        except concurrent.futures.CancelledError:
+            return False
+
+    def cancel(self) -> bool:
+        """Stop the motor now (or drop the command if it has not started yet)."""
+        return self.future.cancel()
+
+    def done(self) -> bool:
+        return self.future.done()
+
+class MotionController:
+    def __init__(self) -> None:
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+
+        # Commands of an actuator take its lock in the order they were scheduled
+        self.locks: dict[str, asyncio.Lock] = {}
+        self.pending: set[tuple[str, asyncio.Task]] = set()
+
+        # Start and stop functions of every actuator
+        self.actuators = {
+            "rover": (rover_L298N.drive, lambda: rover_L298N.drive("stop")),
+            "sensor": (sensor_movement.drive, lambda: sensor_movement.drive("stop")),
+        }
+
+    # MARK: Loop
+    def start(self) -> None:
+        """Start the event loop thread, called on the first command."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name="motion", daemon=True)
+            self.thread.start()
+
+    def close(self) -> None:
+        """Stop every motor and the event loop."""
+        if self.thread is None:
+            return
+        self.cancel_all()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=1)
+        self.thread = None
+        self.loop = None
+        # Locks are bound to the old loop, the next start gets new ones
+        self.locks.clear()
+        self.pending.clear()
+        # The loop may stop before the cancelled commands ran their stop
+        for _, stop in self.actuators.values():
+            stop()
+
+    # MARK: Commands
+    async def command(self, actuator: str, action: str, duration: float, args: tuple, after) -> bool:
+        entry = (actuator, asyncio.current_task())
+        self.pending.add(entry)
+        start, stop = self.actuators[actuator]
+        lock = self.locks.setdefault(actuator, asyncio.Lock())
+        try:
+            # Wait for the command this one follows, then for the actuator to be free
+            if after is not None:
+                await asyncio.wait([asyncio.wrap_future(after.future)])
+            async with lock:
+                start(action, *args)
+                try:
+                    await clock.sleep_async(duration)
+                finally:
+                    stop()
+            return True
+        finally:
+            self.pending.discard(entry)
+
+    def schedule(self, actuator: str, action: str, duration: float, *args, after: MotionHandle | None = None) -> MotionHandle:
+        """
+        Run action on actuator for duration seconds once the actuator is free.
+        :param after: Also wait for this command to finish (e.g. arm moves after the rover arrives)
+        """
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self.command(actuator, action, duration, args, after), self.loop)
+        return MotionHandle(future, actuator, action, duration)
+
+    def rover(self, action: str, duration: float, speed: int = rover_L298N.SPEED, after: MotionHandle | None = None) -> MotionHandle:
+        return self.schedule("rover", action, duration, speed, after=after)
+
+    def sensor(self, direction: str, duration: float = sensor_movement.sensor_movement,
+               speed: int = sensor_movement.movement_speed, after: MotionHandle | None = None) -> MotionHandle:
+        return self.schedule("sensor", direction, duration, speed, after=after)
+
+    def step(self, operations) -> MotionHandle | None:
+        """
+        Schedule the operations of a compiled plan step, returns the handle of the last one.
+        """
+        handle = None
+        for code, duration in operations:
+            action = rover_L298N.ACTION_NAMES[code]
+            # Right turns run at full speed, as move_right does
+            handle = self.rover(action, duration, 100 if action == "right" else rover_L298N.SPEED)
+        return handle
+
+    def cancel_all(self, actuator: str | None = None) -> None:
+        """Cancel every scheduled command (of one actuator), running motors stop now."""
+        if self.loop is None:
+            return
+        def cancel():
+            for name, task in list(self.pending):
+                if actuator is None or name == actuator:
+                    task.cancel()
+        self.loop.call_soon_threadsafe(cancel)
+
+controller = MotionController()
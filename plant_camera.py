@@ -15,15 +15,81 @@
 import os
 import cv2
 import json
+import hashlib
+import threading
 import numpy as np
-from time import time
-from picamera2 import Picamera2
+from collections import deque
+from hardware import create_camera
+from stage_timer import StageTimer
+from image_archive import ImageArchiver
 from concurrent.futures import ThreadPoolExecutor
 
+# MARK: Frame Buffer
+class FrameBuffer:
+    """
+    Bounded ring buffer between the capture and processing threads.
+    
+    Only the newest frames are kept, older frames are dropped and counted.
+    """
+    def __init__(self, size : int = 2) -> None:
+        self.frames : deque = deque(maxlen=size)
+        self.condition = threading.Condition()
+        self.closed : bool = False
+        self.captured : int = 0
+        self.dropped : int = 0
+    
+    def put(self, frame) -> None:
+        with self.condition:
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.frames.append(frame)
+            self.captured += 1
+            self.condition.notify()
+    
+    def get_latest(self, timeout : float = 1.0):
+        """
+        Return the newest frame and drop the stale ones, None if closed or timed out.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.frames or self.closed, timeout)
+            if not self.frames:
+                return None
+            frame = self.frames.pop()
+            self.dropped += len(self.frames)
+            self.frames.clear()
+            return frame
+    
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
 class PlantCam:
     # MARK: init
-    def __init__(self) -> None:
-        self.showVideo : bool = True # TODO: Change
+    def __init__(self, headless : bool = False, camera = None,
+                 hsv_file : str = "config/hsv.json", species_folder : str = "species") -> None:
+        """
+        :param headless: Skip all drawing and OpenCV windows
+        :param camera: Camera to capture from, the hardware backend camera when None
+            (eg: a replay camera for benchmarks without camera hardware)
+        :param hsv_file: JSON file with the HSV range of every species
+        :param species_folder: Folder with the species template images
+        """
+        # Headless mode skips all drawing and OpenCV windows
+        self.headless : bool = headless
+        self.showVideo : bool = not headless # TODO: Change
+        
+        # Classify every pixel in one lookup pass instead of one inRange per species
+        self.single_pass : bool = True
+        
+        # Capture and process frames on separate threads in run
+        self.pipelined : bool = True
+        self.BUFFER_SIZE : int = 2
+        self.frames_processed : int = 0
+        self.frame_buffer : FrameBuffer = FrameBuffer(self.BUFFER_SIZE)
+        
+        # Per-stage latencies of process_frame, free when disabled
+        self.timer : StageTimer = StageTimer(enabled=False) # TODO: Change
         
         # Minimum area threshold to filter small contours
         # Adjust this value based on your use case 
@@ -31,34 +97,144 @@ class PlantCam:
 
         self.save_folder = 'captured_images'
         
-        self.species_folder : str = "species"
+        self.hsv_file : str = hsv_file
+        self.species_folder : str = species_folder
+        # Templates are compared as fixed size descriptors (width, height)
+        self.DESCRIPTOR_SIZE : tuple[int, int] = (32, 32)
+        # Compiled template bank, rebuilt only when the species folder changes
+        self.template_cache_folder : str = "species_cache"
         self.species : str = ""
         self.score : float = 0.0
         self.water_content : float = 0.0
         self.water_content_needed : float = 0.0
+        self.last_result : dict | None = None
+        
+        # Track the last leaf box and only search around it in the next frame
+        self.tracking : bool = True
+        self.TRACK_MARGIN : float = 0.5  # Fraction of the box size added on every side
+        self.TRACK_REFRESH : int = 30    # Force a full-frame scan after this many tracked frames
+        self.last_box : tuple[int, int, int, int] | None = None
+        self.frames_since_full_scan : int = 0
+        
+        # Search for leaves in a small image and take only the leaf crop from the full frame
+        self.dual_resolution : bool = True
+        self.LORES_SIZE : tuple[int, int] = (320, 240) # TODO: Change
+        self.use_lores_stream : bool = True # False downscales the main frame instead
         
         # Initialize the camera using Picamera2
-        self.camera = Picamera2()
-        self.video_config = self.camera.create_video_configuration()
-        self.camera.configure(self.video_config)
-        self.camera.start()
+        if camera is None:
+            camera = create_camera(self.hsv_file)
+        self.camera = camera
         
-        self.load_species_colors()
-        self.load_species_water_content()
-        self.load_species_images()
+        # Starting the camera and loading the species data are independent
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            camera_started = executor.submit(self.start_camera)
+            self.load_species_colors()
+            self.load_species_water_content()
+            self.load_species_images()
+            camera_started.result()
         
-        os.makedirs(self.save_folder, exist_ok=True)
+        # Frames are encoded and written on a background thread inside a storage budget
+        self.archiver : ImageArchiver = ImageArchiver(
+            self.save_folder,
+            image_format="jpg",             # TODO: Change ("jpg" or "png")
+            jpeg_quality=90,                # TODO: Change
+            png_level=3,                    # TODO: Change
+            max_bytes=500 * 1024 * 1024,    # TODO: Change
+            max_age=7 * 24 * 3600,          # TODO: Change
+        )
+    
+    # MARK: Start Camera
+    def start_camera(self):
+        # RGB888 gives 3 channel BGR arrays as expected by OpenCV
+        if self.dual_resolution and self.use_lores_stream:
+            self.video_config = self.camera.create_video_configuration(
+                main={"format": "RGB888"},
+                lores={"size": self.LORES_SIZE, "format": "YUV420"},
+            )
+        else:
+            self.video_config = self.camera.create_video_configuration(main={"format": "RGB888"})
+        self.camera.configure(self.video_config)
+        self.camera.start()
     
     # MARK: Load Species Colors
     def load_species_colors(self):
         # Load species colors from JSON file
-        with open("config/hsv.json", "r") as file:
+        with open(self.hsv_file, "r") as file:
             species_colors = json.load(file)
             file.close()
         self.species_colors = {
             species: (np.array(color_range[0]), np.array(color_range[1])) for species, color_range in species_colors.items()
         }
         print(f"Species Colors: {self.species_colors}")
+        self.build_species_lut()
+    
+    # MARK: Build Species LUT
+    def build_species_lut(self):
+        """
+        Build per-channel HSV lookup tables for single pass classification.
+        
+        Each table entry is a bitset with bit i set when that channel value lies
+        inside the range of species i. ANDing the three channel lookups of a
+        pixel gives every species whose HSV range contains it.
+        """
+        self.species_names : list[str] = list(self.species_colors)
+        count = len(self.species_names)
+        # cv2.LUT tables can be 8, 16 or 32 bit (signed), the sign bit is not used
+        if count > 31:
+            print(f"\033[31mToo many species for single pass classification: {count}\033[0m")
+            self.single_pass = False
+            return
+        
+        dtype = next(dt for dt in (np.uint8, np.uint16, np.int32) if np.iinfo(dt).bits - (dt == np.int32) >= max(count, 1))
+        # One 256 entry table per channel, OpenCV hue is 0-179 so hue entries 180-255 stay empty
+        luts = [np.zeros(256, dtype=dtype) for _ in range(3)]
+        for index, species in enumerate(self.species_names):
+            lower, upper = self.species_colors[species]
+            bit = dtype(1) << dtype(index)
+            for channel, (lut, size) in enumerate(zip(luts, (180, 256, 256))):
+                start = max(int(lower[channel]), 0)
+                stop = min(int(upper[channel]), size - 1)
+                if start <= stop:
+                    lut[start:stop + 1] |= bit
+        self.hue_lut, self.saturation_lut, self.value_lut = luts
+    
+    # MARK: Classify Pixels
+    def classify_pixels(self, hsv):
+        """
+        Label every pixel of an HSV image with the bitset of matching species.
+        """
+        hue, saturation, value = cv2.split(hsv)
+        labels = cv2.bitwise_and(cv2.LUT(hue, self.hue_lut), cv2.LUT(saturation, self.saturation_lut))
+        return cv2.bitwise_and(labels, cv2.LUT(value, self.value_lut))
+    
+    # MARK: Species Mask
+    def species_mask(self, labels, index: int):
+        """
+        Binary mask (0 / 255) of the pixels of a label image labelled with species index.
+        """
+        bit = labels.dtype.type(1) << labels.dtype.type(index)
+        return cv2.compare(labels & bit, 0, cv2.CMP_NE)
+    
+    # MARK: Species Masks
+    def species_masks(self, labels):
+        """
+        Split a label image from classify_pixels into one binary mask per species.
+        """
+        return {species: self.species_mask(labels, index) for index, species in enumerate(self.species_names)}
+    
+    # MARK: Dominant Species
+    def dominant_species(self, labels):
+        """
+        Return the species whose HSV range covers most pixels of a label image.
+        """
+        best_species, best_count = None, 0
+        for index, species in enumerate(self.species_names):
+            bit = labels.dtype.type(1) << labels.dtype.type(index)
+            count = np.count_nonzero(labels & bit)
+            if count > best_count:
+                best_species, best_count = species, count
+        return best_species
     
     # MARK: Load Water Content
     def load_species_water_content(self):
@@ -72,37 +248,202 @@ class PlantCam:
     def load_species_images(self):
         """
         Load species images from the specified folder.
+        
+        Images directly in the folder are named after their species, images in a
+        sub folder all belong to the species named by that sub folder.
         """
         print(f"species_folder: {self.species_folder}")
         
+        species_images = self.list_species_images()
+        if self.load_template_cache(species_images):
+            return
+        
         species_templates = {}
         with ThreadPoolExecutor() as executor:
-            futures = []
-            for file_name in os.listdir(self.species_folder):
-                file_name = file_name.lower()
-                if file_name.endswith((".png", ".jpg", ".jpeg")):
-                    futures.append(executor.submit(self.load_single_image, file_name))
+            futures = [executor.submit(self.load_single_image, file_path, species_name)
+                       for species_name, file_path in species_images]
             for future in futures:
                 species_name, image = future.result()
-                species_templates[species_name] = image
+                if image is None:
+                    continue
+                species_templates.setdefault(species_name, []).append(image)
         self.species_templates = species_templates
+        self.build_template_index()
+        self.save_template_cache(species_images)
+    
+    # MARK: List Species Images
+    def list_species_images(self):
+        """
+        Return (species name, file path) pairs for every template image.
+        """
+        extensions = (".png", ".jpg", ".jpeg")
+        images = []
+        for file_name in sorted(os.listdir(self.species_folder)):
+            file_path = os.path.join(self.species_folder, file_name)
+            if os.path.isdir(file_path):
+                for sub_file_name in sorted(os.listdir(file_path)):
+                    if sub_file_name.lower().endswith(extensions):
+                        images.append((file_name.lower(), os.path.join(file_path, sub_file_name)))
+            elif file_name.lower().endswith(extensions):
+                images.append((os.path.splitext(file_name)[0].lower(), file_path))
+        return images
+    
+    # MARK: File Hash
+    def file_hash(self, file_path):
+        """
+        Return the sha1 hex digest of a file.
+        """
+        digest = hashlib.sha1()
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 16), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    # MARK: Template Manifest
+    def template_manifest(self, species_images, previous = None):
+        """
+        Describe the template files by species, size, mtime and hash.
+        
+        Hashes are reused from previous when size and mtime are unchanged.
+        """
+        previous = previous or {}
+        files = {}
+        for species_name, file_path in species_images:
+            stat = os.stat(file_path)
+            entry = {"species": species_name, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+            old = previous.get(file_path)
+            if old and all(old.get(key) == value for key, value in entry.items()):
+                entry["sha1"] = old["sha1"]
+            else:
+                entry["sha1"] = self.file_hash(file_path)
+            files[file_path] = entry
+        return {"descriptor_size": list(self.DESCRIPTOR_SIZE), "files": files}
+    
+    # MARK: Manifest Key
+    def manifest_key(self, manifest):
+        """
+        Return the part of a manifest that decides whether the bank must be rebuilt.
+        """
+        files = {file_path: (entry["species"], entry["sha1"]) for file_path, entry in manifest["files"].items()}
+        return list(manifest["descriptor_size"]), files
+    
+    # MARK: Load Template Cache
+    def load_template_cache(self, species_images):
+        """
+        Memory map the compiled template bank if it still matches the species folder.
+        Returns True when the cache was used.
+        """
+        manifest_path = os.path.join(self.template_cache_folder, "manifest.json")
+        bank_path = os.path.join(self.template_cache_folder, "templates.npy")
+        try:
+            with open(manifest_path, "r") as file:
+                cached = json.load(file)
+                file.close()
+            manifest = self.template_manifest(species_images, cached["manifest"]["files"])
+            # Only content matters, a touched but unchanged file does not invalidate the bank
+            if self.manifest_key(manifest) != self.manifest_key(cached["manifest"]):
+                print("Template cache is stale, rebuilding")
+                return False
+            
+            descriptors = np.load(bank_path, mmap_mode="r")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Template cache not used: {e}")
+            return False
+        
+        if manifest != cached["manifest"]:
+            # Remember the new mtimes so the files are not hashed again next start
+            cached["manifest"] = manifest
+            try:
+                with open(manifest_path, "w") as file:
+                    json.dump(cached, file)
+            except OSError as e:
+                print(f"\033[31mError updating template manifest: {e}\033[0m")
+        
+        self.species_templates = {}
+        self.template_names = cached["names"]
+        self.template_labels = np.array(cached["labels"], dtype=np.int32)
+        self.template_descriptors = descriptors
+        print(f"Template index: {len(self.template_labels)} templates of {len(self.template_names)} species (cached)")
+        return True
+    
+    # MARK: Save Template Cache
+    def save_template_cache(self, species_images):
+        """
+        Save the compiled template bank and its manifest to the cache folder.
+        """
+        manifest_path = os.path.join(self.template_cache_folder, "manifest.json")
+        bank_path = os.path.join(self.template_cache_folder, "templates.npy")
+        try:
+            os.makedirs(self.template_cache_folder, exist_ok=True)
+            cached = {
+                "manifest": self.template_manifest(species_images),
+                "names": self.template_names,
+                "labels": self.template_labels.tolist(),
+            }
+            # Write to temporary files first so a crash never leaves a half written bank
+            with open(bank_path + ".tmp", "wb") as file:
+                np.save(file, np.ascontiguousarray(self.template_descriptors))
+            with open(manifest_path + ".tmp", "w") as file:
+                json.dump(cached, file)
+            os.replace(bank_path + ".tmp", bank_path)
+            os.replace(manifest_path + ".tmp", manifest_path)
+        except OSError as e:
+            print(f"\033[31mError saving template cache: {e}\033[0m")
     
     # MARK: Load Single Image
-    def load_single_image(self, file_name):
+    def load_single_image(self, file_path, species_name):
         """
         Load a single image and return its species name and image.
         """
-        species_folder = self.species_folder
-        species_name = os.path.splitext(file_name)[0]
-        image = cv2.imread(os.path.join(species_folder, file_name), cv2.IMREAD_COLOR)
+        image = cv2.imread(file_path, cv2.IMREAD_COLOR)
         return species_name, image
     
+    # MARK: Template Descriptor
+    def template_descriptor(self, image):
+        """
+        Reduce an image to a fixed size, zero mean, unit length descriptor.
+        """
+        small = cv2.resize(image, self.DESCRIPTOR_SIZE, interpolation=cv2.INTER_AREA)
+        descriptor = small.astype(np.float32).ravel()
+        descriptor -= descriptor.mean()
+        norm = np.linalg.norm(descriptor)
+        if norm > 0:
+            descriptor /= norm
+        return descriptor
+    
+    # MARK: Build Template Index
+    def build_template_index(self):
+        """
+        Build the descriptor bank that find_matching_species matches against.
+        """
+        names = sorted(self.species_templates)
+        descriptors = []
+        labels = []
+        for label, species in enumerate(names):
+            for template in self.species_templates[species]:
+                descriptors.append(self.template_descriptor(template))
+                labels.append(label)
+        
+        size = self.DESCRIPTOR_SIZE[0] * self.DESCRIPTOR_SIZE[1] * 3
+        self.template_names : list[str] = names
+        self.template_labels = np.array(labels, dtype=np.int32)
+        self.template_descriptors = np.array(descriptors, dtype=np.float32).reshape(-1, size)
+        print(f"Template index: {len(labels)} templates of {len(names)} species")
+    
+    # MARK: Capture
+    def capture(self):
+        """
+        Capture a frame, returns (main frame, lores frame or None).
+        """
+        if self.dual_resolution and self.use_lores_stream:
+            (frame, lores), _ = self.camera.capture_arrays(["main", "lores"])
+            return frame, lores
+        return self.camera.capture_array(), None
+    
     # MARK: Save image
-    def save_image(self, frame):
-        # Save the image
-        filename = f"{self.save_folder}/captured_frame_{int(time.time())}.png"
-        cv2.imwrite(filename, frame)
-        print(f"Image saved as {filename}")
+    def save_image(self, frame, prefix : str = "captured_frame"):
+        # Queue the image for the background archive writer
+        return self.archiver.save(frame, prefix)
     
     # MARK: Water content
     def calculate_water_content(self, species, hue, saturation):
@@ -120,23 +461,19 @@ class PlantCam:
     def find_matching_species(self, leaf_crop):
         """
         Compare the given cropped leaf image with species templates and find the best match.
+        
+        The score is the squared distance between normalized descriptors (0 to 4, lower is better).
         """
         best_match = None
         best_score = float('inf')
         
-        for species, template in self.species_templates.items():
-            if template is None:
-                continue
-            
-            # Resize template to match the leaf crop dimensions
-            resized_template = cv2.resize(template, (leaf_crop.shape[1], leaf_crop.shape[0]))
-            
-            # Compute Mean Squared Error (MSE) between images
-            mse = np.mean((leaf_crop.astype("float") - resized_template.astype("float")) ** 2)
-            
-            if mse < best_score:
-                best_score = mse
-                best_match = species
+        if len(self.template_labels) and leaf_crop.size:
+            # Unit length descriptors: |t - d|^2 = 2 - 2 * (t . d), one matrix product for the whole bank
+            descriptor = self.template_descriptor(leaf_crop)
+            similarity = self.template_descriptors @ descriptor
+            best = int(np.argmax(similarity))
+            best_match = self.template_names[self.template_labels[best]]
+            best_score = round(float(2.0 - 2.0 * similarity[best]), 4)
         
         if best_match is None:
             best_match =  "Unknown"
@@ -161,51 +498,93 @@ class PlantCam:
             print(f"Error processing species '{species}': {e}")
             return species, []
     
-    # MARK: Process Frame
-    def process_frame(self, frame):
+    # MARK: Locate Leaf
+    def locate_leaf(self, hsv, min_area = None):
         """
-        Process a single frame to detect leaves of different species and estimate water content.
+        Find the largest leaf with one inRange pass per species.
+        Returns the colour mask and the bounding box of the leaf (None if no leaf).
         """
-        
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        if min_area is None:
+            min_area = self.MIN_CONTOUR_AREA
         results = []
         
         for species, color_range in self.species_colors.items():
-            species, contours = self.process_species_mask((hsv, species, color_range))
+            with self.timer.stage("mask"):
+                species, contours = self.process_species_mask((hsv, species, color_range))
             print(f"Species: {species}, Contours: {len(contours)}")
             
             # Filter contours by size
-            contours = [cnt for cnt in contours if cv2.contourArea(cnt) >= self.MIN_CONTOUR_AREA]
+            with self.timer.stage("contours"):
+                contours = [cnt for cnt in contours if cv2.contourArea(cnt) >= min_area]
             print(f"Species: {species}, Filtered Contours: {len(contours)}")
             
             results.append((species, contours))
         
         contours = []
-        for species, species_contours in results:
-            contours.extend(species_contours)
-            mask = cv2.inRange(hsv, *self.species_colors[species])
+        mask = np.zeros(hsv.shape[:2], dtype=np.uint8)
+        with self.timer.stage("union_mask"):
+            for species, species_contours in results:
+                contours.extend(species_contours)
+                mask = cv2.inRange(hsv, *self.species_colors[species])
         
-        if self.showVideo:
-            cv2.imshow("Green Mask", mask)
+        if not contours:
+            return mask, None
+        
+        # Find the largest contour
+        largest_contour = max(contours, key=cv2.contourArea)
+        return mask, cv2.boundingRect(largest_contour)
+    
+    # MARK: Locate Leaf Single Pass
+    def locate_leaf_single_pass(self, hsv, min_area = None):
+        """
+        Find the largest leaf of all species with a single lookup table pass.
+        Returns the colour mask, the bounding box of the leaf (None if no leaf) and
+        the label image, split it into per-species masks with species_masks.
+        """
+        if min_area is None:
+            min_area = self.MIN_CONTOUR_AREA
+        with self.timer.stage("classify"):
+            labels = self.classify_pixels(hsv)
+            mask = cv2.compare(labels, 0, cv2.CMP_NE)
+        
+        with self.timer.stage("contours"):
+            found_contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+            contours = [cnt for cnt in found_contours if cv2.contourArea(cnt) >= min_area]
+        print(f"Contours: {len(found_contours)}, Filtered Contours: {len(contours)}")
         
         if not contours:
-            return frame
+            return mask, None, labels
         
         # Find the largest contour
         largest_contour = max(contours, key=cv2.contourArea)
         x, y, w, h = cv2.boundingRect(largest_contour)
+        
+        # Measure colour only over pixels of the species covering the leaf
+        with self.timer.stage("leaf_mask"):
+            leaf_labels = labels[y:y + h, x:x + w]
+            color_species = self.dominant_species(leaf_labels)
+            if color_species is not None:
+                mask[y:y + h, x:x + w] = self.species_mask(leaf_labels, self.species_names.index(color_species))
+        print(f"Colour Species: {color_species}")
+        
+        return mask, (x, y, w, h), labels
+    
+    # MARK: Measure Leaf
+    def measure_leaf(self, frame, hsv, mask, box):
+        """
+        Match the species of the leaf inside box and estimate its water content.
+        """
+        x, y, w, h = box
         cropped_leaf = frame[y:y + h, x:x + w]
         cropped_hsv = hsv[y:y + h, x:x + w]
         
         # Find matching species from folder
-        self.find_matching_species(cropped_leaf)
+        with self.timer.stage("match"):
+            self.find_matching_species(cropped_leaf)
         print(f"Species: {self.species}, Score: {self.score}")
         
-        if self.showVideo:
-            # Display the cropped leaf for debugging
-            cv2.imshow(f"{self.species} Cropped Leaf", cropped_leaf)
-        
-        mean_color = cv2.mean(cropped_hsv, mask=mask[y:y + h, x:x + w])
+        with self.timer.stage("mean_color"):
+            mean_color = cv2.mean(cropped_hsv, mask=mask[y:y + h, x:x + w])
         hue, saturation, _ = mean_color[:3]
         hue, saturation = round(hue, 2), round(saturation, 2)
         
@@ -214,15 +593,181 @@ class PlantCam:
         print(f"Species {self.species} with {hue}, {saturation}")
         self.water_content = self.calculate_water_content(self.species, hue, saturation)
         
-        if self.species == None:
+        return {
+            "species": self.species,
+            "score": self.score,
+            "hue": hue,
+            "saturation": saturation,
+            "water_content": self.water_content,
+            "water_content_needed": self.water_content_needed,
+        }
+    
+    # MARK: Tracking ROI
+    def tracking_roi(self, image_shape, scale = (1.0, 1.0)):
+        """
+        Return the region around the last leaf box to search in, None for a full-frame scan.
+        scale is the (x, y) size of the full frame relative to the searched image.
+        """
+        if not self.tracking or self.last_box is None:
+            return None
+        if self.frames_since_full_scan >= self.TRACK_REFRESH:
+            return None
+        
+        image_h, image_w = image_shape[:2]
+        scale_x, scale_y = scale
+        x, y, w, h = self.last_box
+        x, y, w, h = int(x / scale_x), int(y / scale_y), int(w / scale_x), int(h / scale_y)
+        margin_x = int(w * self.TRACK_MARGIN)
+        margin_y = int(h * self.TRACK_MARGIN)
+        x0, y0 = max(x - margin_x, 0), max(y - margin_y, 0)
+        x1, y1 = min(x + w + margin_x, image_w), min(y + h + margin_y, image_h)
+        return x0, y0, x1 - x0, y1 - y0
+    
+    # MARK: Reset Tracking
+    def reset_tracking(self):
+        """
+        Forget the tracked leaf so the next frame is scanned in full (eg: at a new stop).
+        """
+        self.last_box = None
+        self.frames_since_full_scan = 0
+    
+    # MARK: Detection Image
+    def detection_image(self, frame, lores = None):
+        """
+        Return the image leaves are searched in and the (x, y) scale of frame relative to it.
+        
+        In dual resolution mode this is the lores stream frame (YUV420) or a
+        downscaled copy of frame, otherwise frame itself.
+        """
+        if not self.dual_resolution:
+            return frame, (1.0, 1.0)
+        
+        with self.timer.stage("downscale"):
+            if lores is not None:
+                small = cv2.cvtColor(lores, cv2.COLOR_YUV420p2BGR)
+            else:
+                small = cv2.resize(frame, self.LORES_SIZE, interpolation=cv2.INTER_AREA)
+        return small, (frame.shape[1] / small.shape[1], frame.shape[0] / small.shape[0])
+    
+    # MARK: Detect Region
+    def detect_region(self, frame, image, scale, roi = None):
+        """
+        Detect the largest leaf inside roi (x, y, w, h) of image, or in the whole image.
+        
+        image is frame itself or a smaller copy of it scaled by scale. Only the
+        leaf crop is taken from frame for species matching and colour measurement.
+        The box in the result is in frame coordinates, the mask covers only roi of image.
+        In single pass mode the result also has the label image of roi, per-species
+        masks are species_masks(result["labels"]).
+        """
+        if roi is None:
+            roi = (0, 0, image.shape[1], image.shape[0])
+        rx, ry, rw, rh = roi
+        scale_x, scale_y = scale
+        region = image[ry:ry + rh, rx:rx + rw]
+        
+        with self.timer.stage("convert"):
+            hsv = cv2.cvtColor(region, cv2.COLOR_BGR2HSV)
+        
+        min_area = self.MIN_CONTOUR_AREA / (scale_x * scale_y)
+        if self.single_pass:
+            mask, box, labels = self.locate_leaf_single_pass(hsv, min_area)
+        else:
+            mask, box = self.locate_leaf(hsv, min_area)
+            labels = None
+        
+        result = {
+            "frame": frame,
+            "mask": mask,
+            "labels": labels,
+            "roi": roi,
+            "box": None,
+            "species": None,
+            "score": None,
+            "hue": None,
+            "saturation": None,
+            "water_content": None,
+            "water_content_needed": None,
+        }
+        if box is None:
+            return result
+        
+        x, y, w, h = box
+        # A leaf cut by the edge of a partial region may extend beyond it
+        result["clipped"] = (
+            (x == 0 and rx > 0) or (y == 0 and ry > 0)
+            or (x + w == rw and rx + rw < image.shape[1])
+            or (y + h == rh and ry + rh < image.shape[0])
+        )
+        
+        if image is frame:
+            result.update(self.measure_leaf(region, hsv, mask, box))
+            result["box"] = (x + rx, y + ry, w, h)
+            return result
+        
+        # Map the box back to the full resolution frame and measure only the leaf crop there
+        fx, fy = int((x + rx) * scale_x), int((y + ry) * scale_y)
+        fw = max(min(int(round(w * scale_x)), frame.shape[1] - fx), 1)
+        fh = max(min(int(round(h * scale_y)), frame.shape[0] - fy), 1)
+        crop = frame[fy:fy + fh, fx:fx + fw]
+        with self.timer.stage("convert_crop"):
+            crop_hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
+            crop_mask = cv2.resize(mask[y:y + h, x:x + w], (fw, fh), interpolation=cv2.INTER_NEAREST)
+        result.update(self.measure_leaf(crop, crop_hsv, crop_mask, (0, 0, fw, fh)))
+        result["box"] = (fx, fy, fw, fh)
+        return result
+    
+    # MARK: Detect
+    def detect(self, frame, lores = None):
+        """
+        Detect the largest leaf in a frame and estimate its water content.
+        
+        Nothing is drawn or displayed, the frame is kept in the result so
+        render can annotate it later if a consumer asks for it.
+        
+        With tracking enabled only the region around the last leaf is searched,
+        falling back to a full-frame scan when the leaf is lost.
+        With dual resolution the search runs on lores (or a downscaled frame).
+        """
+        with self.timer.stage("detect"):
+            image, scale = self.detection_image(frame, lores)
+            roi = self.tracking_roi(image.shape, scale)
+            result = self.detect_region(frame, image, scale, roi)
+            
+            if roi is not None and (result["box"] is None or result.get("clipped")):
+                print("Tracked leaf lost, scanning full frame")
+                roi = None
+                result = self.detect_region(frame, image, scale)
+        
+        self.frames_since_full_scan = 0 if roi is None else self.frames_since_full_scan + 1
+        self.last_box = result["box"]
+        self.last_result = result
+        return result
+    
+    # MARK: Annotate
+    def annotate(self, frame, result):
+        """
+        Draw the detected leaf, species and water content onto frame.
+        """
+        if result["box"] is None:
+            return frame
+        
+        with self.timer.stage("annotate"):
+            return self.draw_result(frame, result)
+    
+    # MARK: Draw Result
+    def draw_result(self, frame, result):
+        x, y, w, h = result["box"]
+        
+        if result["species"] == None:
             species = "Unknown"
         else:
-            species = self.species
+            species = result["species"]
         
-        if self.water_content == None:
+        if result["water_content"] == None:
             water_content = 0.0
         else:
-            water_content = round(self.water_content, 2)
+            water_content = round(result["water_content"], 2)
         
         print(f"Species: {species}, Water Content: {water_content}%")
         
@@ -233,21 +778,185 @@ class PlantCam:
         
         return frame
     
+    # MARK: Render
+    def render(self, result):
+        """
+        Return an annotated copy of the frame a result was detected on.
+        """
+        return self.annotate(result["frame"].copy(), result)
+    
+    # MARK: Show Debug
+    def show_debug(self, result):
+        """
+        Display the colour mask and the cropped leaf for debugging.
+        """
+        cv2.imshow("Green Mask", result["mask"])
+        
+        if result.get("labels") is not None:
+            for species, species_mask in self.species_masks(result["labels"]).items():
+                cv2.imshow(f"{species} Mask", species_mask)
+        
+        if result["box"] is not None:
+            x, y, w, h = result["box"]
+            cv2.imshow(f"{result['species']} Cropped Leaf", result["frame"][y:y + h, x:x + w])
+    
+    # MARK: Process Frame
+    def process_frame(self, frame, lores = None):
+        """
+        Process a single frame to detect leaves of different species and estimate water content.
+        
+        In headless mode the frame is returned untouched without any drawing.
+        """
+        result = self.detect(frame, lores)
+        
+        if self.headless:
+            return frame
+        
+        if self.showVideo:
+            self.show_debug(result)
+        
+        return self.annotate(frame, result)
+    
+    # MARK: Stage Timings
+    def stage_timings(self) -> dict[str, dict[str, float]]:
+        """
+        Return the p50 / p95 / p99 latency (ms) of every process_frame stage.
+        """
+        return self.timer.summary()
+    
+    # MARK: Pipeline Stats
+    def pipeline_stats(self) -> dict[str, int]:
+        """
+        Return the captured, processed and dropped frame counters of the pipeline.
+        """
+        return {
+            "captured": self.frame_buffer.captured,
+            "processed": self.frames_processed,
+            "dropped": self.frame_buffer.dropped,
+        }
+    
+    # MARK: Capture Loop
+    def capture_loop(self, stop_event):
+        """
+        Capture frames into the frame buffer until stop_event is set.
+        """
+        try:
+            while not stop_event.is_set():
+                self.frame_buffer.put(self.capture())
+        except Exception as e:
+            print(f"\033[31mError capturing frame: {e}\033[0m")
+        finally:
+            stop_event.set()
+            self.frame_buffer.close()
+    
+    # MARK: Processing Loop
+    def processing_loop(self, stop_event, results):
+        """
+        Process the newest buffered frame until stop_event is set.
+        
+        Detection results are handed over through results, a one slot deque.
+        """
+        try:
+            while not stop_event.is_set():
+                capture = self.frame_buffer.get_latest()
+                if capture is None:
+                    continue
+                results.append(self.detect(*capture))
+                self.frames_processed += 1
+        except Exception as e:
+            print(f"\033[31mError processing frame: {e}\033[0m")
+        finally:
+            stop_event.set()
+    
+    # MARK: Run Pipelined
+    def run_pipelined(self):
+        """
+        Run the video feed with capture and processing on their own threads.
+        
+        The calling thread only displays results and handles keys, because
+        OpenCV windows have to stay on one thread.
+        """
+        if self.headless:
+            print("Press Ctrl+C to exit the headless feed.")
+        else:
+            print("Press 'q' to exit the video feed.")
+        self.frame_buffer = FrameBuffer(self.BUFFER_SIZE)
+        self.frames_processed = 0
+        stop_event = threading.Event()
+        results = deque(maxlen=1)
+        
+        threads = [
+            threading.Thread(target=self.capture_loop, args=(stop_event,), daemon=True),
+            threading.Thread(target=self.processing_loop, args=(stop_event, results), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        
+        try:
+            while not stop_event.is_set():
+                if not results:
+                    stop_event.wait(0.005)
+                    if not self.headless:
+                        cv2.waitKey(1)
+                    continue
+                result = results.pop()
+                
+                if self.headless:
+                    continue
+                
+                if self.showVideo:
+                    # Display the frame with annotations
+                    self.show_debug(result)
+                    cv2.imshow("Leaf Water Content Estimation", self.render(result))
+                
+                key = cv2.waitKey(1) & 0xFF
+                # Save the image on 's' key
+                if key == ord('s'):
+                    self.save_image(result["frame"])
+                
+                # Break loop on 'q' key
+                if key == ord('q'):
+                    print("Exiting video feed.")
+                    break
+        
+        except KeyboardInterrupt:
+            print("Video feed interrupted by user.")
+        
+        finally:
+            stop_event.set()
+            self.frame_buffer.close()
+            for thread in threads:
+                thread.join(timeout=2)
+            print(f"Pipeline stats: {self.pipeline_stats()}")
+            if self.timer.enabled:
+                self.timer.print_summary()
+            # Cleanup
+            if not self.headless:
+                cv2.destroyAllWindows()
+            self.camera.stop()
+            self.archiver.close()
+    
     # MARK: Run
     def run(self):
+        if self.pipelined:
+            return self.run_pipelined()
+        
         print("Press 'q' to exit the video feed.")
         try:
             while True:
                 # Capture a frame from the camera
-                frame = self.camera.capture_array()
+                frame, lores = self.capture()
                 
                 # Process the frame
-                processed_frame = self.process_frame(frame)
+                processed_frame = self.process_frame(frame, lores)
                 
                 if self.showVideo:
                     # Display the frame with annotations
                     cv2.imshow("Leaf Water Content Estimation", processed_frame)
                 
+                if self.headless:
+                    continue
+                
                 # Save the image on 's' key
                 if cv2.waitKey(1) & 0xFF == ord('s'):
                     self.save_image(frame)
@@ -263,8 +972,10 @@ class PlantCam:
         
         finally:
             # Cleanup
-            cv2.destroyAllWindows()
+            if not self.headless:
+                cv2.destroyAllWindows()
             self.camera.stop()
+            self.archiver.close()
             
 
 if __name__ == "__main__":
@@ -0,0 +1,202 @@
+# replay_benchmark.py
+"""
+    Code that benchmarks the vision pipeline without a camera
+    
+    Feeds recorded or synthetic frames through PlantCam using a stand-in camera
+    -> replays a directory of recorded frames (png / jpg)
+    -> or generates synthetic leaves in the colours of hsv.json
+    -> reports throughput (frames/s), per-frame latency (p50 / p95 / p99),
+       per-stage latencies and peak memory
+    eg: python replay_benchmark.py --frames recordings/ --count 500
+        python replay_benchmark.py --synthetic --hsv config/hsv.json --species species
+"""
+
+import os
+import io
+import sys
+import cv2
+import json
+import resource
+import argparse
+import tracemalloc
+import numpy as np
+from time import perf_counter
+from contextlib import nullcontext, redirect_stdout
+
+from stage_timer import StageTimer
+from plant_camera import PlantCam
+
+# MARK: Replay Camera
+class ReplayCamera:
+    """
+    Stand-in for Picamera2 that returns frames from a list or a generator.
+    
+    Implements the parts of the Picamera2 API that PlantCam uses.
+    """
+    def __init__(self, frames) -> None:
+        """
+        :param frames: Iterable of BGR frames, replayed in a loop if it is a list
+        """
+        self.frames = frames
+        self.iterator = iter(frames)
+        self.lores_size : tuple[int, int] | None = None
+    
+    def create_video_configuration(self, main = None, lores = None):
+        return {"main": main or {}, "lores": lores}
+    
+    def configure(self, config) -> None:
+        lores = config.get("lores")
+        self.lores_size = tuple(lores["size"]) if lores else None
+    
+    def start(self) -> None:
+        pass
+    
+    def stop(self) -> None:
+        pass
+    
+    def capture_array(self, name : str = "main"):
+        frame = self.next_frame()
+        return self.lores_frame(frame) if name == "lores" else frame
+    
+    def capture_arrays(self, names):
+        frame = self.next_frame()
+        arrays = [self.lores_frame(frame) if name == "lores" else frame for name in names]
+        return arrays, {}
+    
+    def next_frame(self):
+        try:
+            return next(self.iterator)
+        except StopIteration:
+            if not isinstance(self.frames, list):
+                raise
+            self.iterator = iter(self.frames)
+            return next(self.iterator)
+    
+    def lores_frame(self, frame):
+        """
+        Downscale a frame to the lores size in YUV420 like the Picamera2 lores stream.
+        """
+        small = cv2.resize(frame, self.lores_size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2YUV_I420)
+
+# MARK: Load Frames
+def load_frames(folder: str):
+    """
+    Decode every recorded frame in folder up front so decoding is not benchmarked.
+    """
+    frames = []
+    for file_name in sorted(os.listdir(folder)):
+        if file_name.lower().endswith((".png", ".jpg", ".jpeg")):
+            frame = cv2.imread(os.path.join(folder, file_name), cv2.IMREAD_COLOR)
+            if frame is not None:
+                frames.append(frame)
+    if not frames:
+        raise FileNotFoundError(f"No frames found in {folder}")
+    return frames
+
+# MARK: Synthetic Frames
+def synthetic_frames(hsv_file: str, size: tuple[int, int] = (1280, 720), seed: int = 0):
+    """
+    Generate frames with one slowly drifting leaf coloured inside a random species HSV range.
+    """
+    with open(hsv_file, "r") as file:
+        species_colors = json.load(file)
+        file.close()
+    ranges = [(np.array(low), np.array(high)) for low, high in species_colors.values()]
+    
+    rng = np.random.default_rng(seed)
+    width, height = size
+    background = rng.integers(0, 60, (height, width, 3), dtype=np.uint8)
+    center = np.array([width // 2, height // 2], dtype=np.float64)
+    
+    frame_index = 0
+    while True:
+        # A new plant every 100 frames, small drift in between like a parked rover
+        if frame_index % 100 == 0:
+            low, high = ranges[rng.integers(len(ranges))]
+            hsv_color = np.uint8([[(low + high) // 2]])
+            color = tuple(int(c) for c in cv2.cvtColor(hsv_color, cv2.COLOR_HSV2BGR)[0, 0])
+            axes = (int(rng.integers(width // 10, width // 4)), int(rng.integers(height // 10, height // 4)))
+            center = np.array([rng.integers(width // 4, 3 * width // 4), rng.integers(height // 4, 3 * height // 4)], dtype=np.float64)
+        center += rng.normal(0, 2, 2)
+        
+        frame = background.copy()
+        cv2.ellipse(frame, (int(center[0]), int(center[1])), axes, 30, 0, 360, color, -1)
+        frame_index += 1
+        yield frame
+
+# MARK: Benchmark
+def benchmark(camera: PlantCam, count: int, warmup: int = 10, quiet: bool = True, memory_frames: int = 30):
+    """
+    Run count frames through camera.detect and return throughput, latency and memory stats.
+    
+    Peak memory is traced in a separate pass of memory_frames frames, tracing
+    every allocation would slow down the timed frames.
+    """
+    frame_timer = StageTimer(enabled=True, window=count)
+    
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull) if quiet else nullcontext():
+        for _ in range(warmup):
+            camera.detect(*camera.capture())
+        camera.timer.reset()
+        
+        start = perf_counter()
+        for _ in range(count):
+            frame, lores = camera.capture()
+            with frame_timer.stage("frame"):
+                camera.detect(frame, lores)
+        elapsed = perf_counter() - start
+        stages = camera.stage_timings()
+        
+        tracemalloc.start()
+        for _ in range(min(memory_frames, count)):
+            camera.detect(*camera.capture())
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    
+    return {
+        "frames": count,
+        "seconds": round(elapsed, 3),
+        "fps": round(count / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": frame_timer.summary().get("frame", {}),
+        "stages_ms": stages,
+        "peak_traced_mb": round(peak / 2 ** 20, 2),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+    }
+
+# MARK: main
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PlantCam vision pipeline on recorded or synthetic frames")
+    parser.add_argument("--frames", help="Folder of recorded frames to replay")
+    parser.add_argument("--synthetic", action="store_true", help="Generate synthetic frames instead")
+    parser.add_argument("--size", default="1280x720", help="Synthetic frame size, WIDTHxHEIGHT")
+    parser.add_argument("--count", type=int, default=300, help="Number of frames to benchmark")
+    parser.add_argument("--hsv", default="config/hsv.json", help="HSV ranges of the species")
+    parser.add_argument("--species", default="species", help="Folder of species templates")
+    parser.add_argument("--output", help="Save the report as json")
+    parser.add_argument("--verbose", action="store_true", help="Keep the pipeline output")
+    args = parser.parse_args()
+    
+    if args.frames:
+        frames = load_frames(args.frames)
+    elif args.synthetic:
+        width, height = (int(value) for value in args.size.lower().split("x"))
+        frames = synthetic_frames(args.hsv, (width, height))
+    else:
+        parser.error("Use --frames FOLDER or --synthetic")
+    
+    with redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+        camera = PlantCam(headless=True, camera=ReplayCamera(frames), hsv_file=args.hsv, species_folder=args.species)
+    camera.timer.enabled = True
+    
+    report = benchmark(camera, args.count, quiet=not args.verbose)
+    camera.archiver.close()
+    
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+        print(f"\033[32mReport saved to {args.output}\033[0m")
+
+if __name__ == "__main__":
+    main()
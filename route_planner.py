@@ -0,0 +1,360 @@
+# route_planner.py
+"""
+    Code that plans the route of the robot through the stops
+
+    Reads the stop positions from stops.csv (Stop,X,Y)
+    -> orders them to minimise the mission time, turns included: every order for a few
+       stops, else a nearest neighbour + 2-opt tour refined with turn aware 2-opt and or-opt
+    -> never returns an order slower than the file order
+    -> converts every leg into turns and forward moves with the timing model of rover_L298N
+       (distance * DISTANCE_TIME seconds forward, degrees * ANGLE_TIME seconds turning)
+    -> writes the movement plan to movements.csv, one step per stop
+
+    The robot starts at the origin facing the positive X axis
+    eg: python route_planner.py movements/stops.csv --output movements/movements.csv
+"""
+
+import csv
+import math
+import argparse
+import itertools
+import numpy as np
+from rover_L298N import DISTANCE_TIME, ANGLE_TIME
+
+# MARK: Stops
+def load_stops(file_path: str = 'movements/stops.csv') -> tuple[list[str], np.ndarray]:
+    """
+    Read the stop names and (x, y) positions from a CSV with a Stop,X,Y header.
+    """
+    names, points = [], []
+    with open(file_path, 'r', newline='') as file:
+        reader = csv.reader(file)
+        next(reader, None)  # Header
+        for line in reader:
+            if not line or not line[0].strip():
+                continue
+            try:
+                points.append((float(line[1]), float(line[2])))
+            except (IndexError, ValueError):
+                raise ValueError(f"line {reader.line_num}: expected Stop,X,Y in {file_path}") from None
+            names.append(line[0].strip())
+    return names, np.array(points, dtype=np.float64).reshape(-1, 2)
+
+def write_plan(steps: list[tuple[str, list[tuple[str, float]]]], file_path: str = 'movements/movements.csv') -> None:
+    """
+    Write (label, [(action, duration), ...]) steps in the movements.csv format.
+    """
+    actions = max((len(operations) for _, operations in steps), default=0)
+    with open(file_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Step"] + [f"Action {i}" for i in range(1, actions + 1)])
+        for label, operations in steps:
+            writer.writerow([label] + [f"{action.capitalize()}: {round(duration, 3):g}" for action, duration in operations])
+
+class RoutePlanner:
+    # MARK: init
+    def __init__(self, distance_time: float = DISTANCE_TIME, angle_time: float = ANGLE_TIME,
+                 start = (0.0, 0.0), heading: float = 0.0, stop_time: float = 0.0) -> None:
+        """
+        :param distance_time: Seconds of forward movement per unit of distance
+        :param angle_time: Seconds of turning per degree
+        :param start: Position the robot starts from
+        :param heading: Starting heading in degrees, counter-clockwise from the X axis
+        :param stop_time: Seconds spent at every stop (measuring, watering), added to the estimate
+        """
+        self.distance_time : float = distance_time
+        self.angle_time : float = angle_time
+        self.start = np.asarray(start, dtype=np.float64)
+        self.heading : float = heading
+        self.stop_time : float = stop_time
+
+    # MARK: Timing
+    def travel_times(self, points: np.ndarray) -> np.ndarray:
+        """
+        Forward travel time between every pair of positions, index 0 is the start.
+        """
+        positions = np.vstack((self.start, points))
+        difference = positions[:, None, :] - positions[None, :, :]
+        return np.hypot(difference[..., 0], difference[..., 1]) * self.distance_time
+
+    def legs(self, points: np.ndarray, order) -> list[list[tuple[str, float]]]:
+        """
+        Turns and forward moves to reach every stop of order, starting from the start position.
+        """
+        legs = []
+        position, heading = self.start, self.heading
+        for index in order:
+            target = points[index]
+            dx, dy = target - position
+            operations = []
+            if dx or dy:
+                bearing = math.degrees(math.atan2(dy, dx))
+                turn = (bearing - heading + 180) % 360 - 180
+                if turn:
+                    operations.append(("left" if turn > 0 else "right", abs(turn) * self.angle_time))
+                operations.append(("forward", math.hypot(dx, dy) * self.distance_time))
+                heading = bearing
+            legs.append(operations)
+            position = target
+        return legs
+
+    def mission_time(self, points: np.ndarray, order) -> float:
+        """
+        Estimated mission duration visiting the stops in order, turns and stops included.
+        Same timing as legs, evaluated with NumPy for the whole order at once.
+        """
+        order = np.asarray(list(order), dtype=np.intp)
+        positions = np.vstack((self.start, points[order]))
+        difference = np.diff(positions, axis=0)
+        distance = np.hypot(difference[:, 0], difference[:, 1])
+        
+        # Zero length legs keep the heading
+        moving = distance > 0
+        bearings = np.degrees(np.arctan2(difference[moving, 1], difference[moving, 0]))
+        headings = np.concatenate(([self.heading], bearings))
+        turns = np.abs((np.diff(headings) + 180) % 360 - 180)
+        
+        return float(distance.sum() * self.distance_time + turns.sum() * self.angle_time + self.stop_time * len(order))
+
+    # MARK: Tour
+    def nearest_neighbour(self, times: np.ndarray) -> list[int]:
+        """
+        Greedy tour from the start, always driving to the closest unvisited stop.
+        """
+        unvisited = np.ones(len(times), dtype=bool)
+        unvisited[0] = False
+        tour, current = [], 0
+        for _ in range(len(times) - 1):
+            candidates = np.where(unvisited, times[current], np.inf)
+            current = int(np.argmin(candidates))
+            unvisited[current] = False
+            tour.append(current)
+        return tour
+
+    def two_opt(self, times: np.ndarray, tour: list[int], max_passes: int = 50) -> list[int]:
+        """
+        Reverse segments of the open tour while that shortens it, every candidate
+        segment end for a given start is evaluated at once.
+        """
+        route = np.array([0] + tour)
+        n = len(route)
+        for _ in range(max_passes):
+            improved = False
+            for i in range(1, n - 1):
+                a, b = route[i - 1], route[i]
+                j = np.arange(i + 1, n)
+                c = route[j]
+                after = route[np.minimum(j + 1, n - 1)]
+                last = j == n - 1
+                delta = times[a, c] - times[a, b] + np.where(last, 0.0, times[b, after] - times[c, after])
+                best = int(np.argmin(delta))
+                if delta[best] < -1e-9:
+                    k = j[best]
+                    route[i:k + 1] = route[i:k + 1][::-1]
+                    improved = True
+            if not improved:
+                break
+        return [int(index) for index in route[1:]]
+
+    def turn_time(self, heading: float, bearing: float) -> float:
+        """Seconds to turn from heading to bearing (degrees) the short way round."""
+        return abs((bearing - heading + 180) % 360 - 180) * self.angle_time
+
+    def route_legs(self, route: list[int], times: list[list[float]], bearings: list[list[float]]):
+        """
+        Bearing (None for zero length legs), turn time and cumulative time of every leg of route,
+        node 0 is the start and leg p drives from route[p - 1] to route[p].
+        """
+        leg_bearings, turns, cumulative = [None], [0.0], [0.0]
+        heading = self.heading
+        for u, v in zip(route, route[1:]):
+            bearing, turn, cost = None, 0.0, 0.0
+            # Zero length legs keep the heading
+            if times[u][v] > 0:
+                bearing = bearings[u][v]
+                turn = self.turn_time(heading, bearing)
+                cost = times[u][v] + turn
+                heading = bearing
+            leg_bearings.append(bearing)
+            turns.append(turn)
+            cumulative.append(cumulative[-1] + cost)
+        return leg_bearings, turns, cumulative
+
+    def pieces_time(self, pieces, route: list[int], times, bearings, legs) -> float | None:
+        """
+        Travel time of the route made of pieces (lo, hi, reversed) of route positions.
+        Legs inside a piece keep their time (reversed too) so only the joins and the first
+        turn of every piece are computed. None when a piece starts or ends with a zero length leg.
+        """
+        leg_bearings, turns, cumulative = legs
+        total, heading, previous = 0.0, self.heading, None
+        for lo, hi, reverse in pieces:
+            first, last = (route[hi], route[lo]) if reverse else (route[lo], route[hi])
+            if previous is not None and times[previous][first] > 0:
+                bearing = bearings[previous][first]
+                total += times[previous][first] + self.turn_time(heading, bearing)
+                heading = bearing
+            if hi > lo:
+                start_bearing, end_bearing = leg_bearings[lo + 1], leg_bearings[hi]
+                if start_bearing is None or end_bearing is None:
+                    return None
+                if reverse:
+                    start_bearing, end_bearing = end_bearing + 180, start_bearing + 180
+                total += cumulative[hi] - cumulative[lo] - turns[lo + 1] + self.turn_time(heading, start_bearing)
+                heading = end_bearing
+            previous = last
+        return total
+
+    def refine(self, points: np.ndarray, tour: list[int], neighbours: np.ndarray, max_passes: int = 20) -> list[int]:
+        """
+        Improve a tour with 2-opt and or-opt moves scored with turns, only the legs a move
+        changes are timed. Only moves next to the neighbours (nearest stops) of a stop are tried.
+        :param neighbours: Nearest stops of the start (row 0) and of every stop (row i + 1)
+        """
+        times = self.travel_times(points).tolist()
+        positions = np.vstack((self.start, points))
+        difference = positions[None, :, :] - positions[:, None, :]
+        bearings = np.degrees(np.arctan2(difference[..., 1], difference[..., 0])).tolist()
+        
+        n = len(tour)
+        route = [0] + [stop + 1 for stop in tour]
+        legs = self.route_legs(route, times, bearings)
+        position = {stop: k for k, stop in enumerate(tour)}
+        
+        def join(pieces) -> list[int]:
+            return [route[k] for lo, hi, reverse in pieces for k in (range(hi, lo - 1, -1) if reverse else range(lo, hi + 1))]
+        
+        def score(pieces) -> float:
+            time = self.pieces_time(pieces, route, times, bearings, legs)
+            if time is None:
+                # A zero length leg next to a join, time the whole candidate
+                time = self.mission_time(points, [node - 1 for node in join(pieces)[1:]]) - self.stop_time * n
+            return time
+        
+        def apply(pieces) -> None:
+            nonlocal route, legs, position, tour
+            route = join(pieces)
+            legs = self.route_legs(route, times, bearings)
+            tour = [node - 1 for node in route[1:]]
+            position = {stop: k for k, stop in enumerate(tour)}
+        
+        for _ in range(max_passes):
+            improved = False
+            
+            # 2-opt: reverse tour[i..j] so tour[i - 1] (or the start) is followed by a neighbour
+            for i in range(n):
+                previous = route[i]
+                for neighbour in neighbours[previous]:
+                    j = position[int(neighbour)]
+                    if j <= i:
+                        continue
+                    pieces = [(0, i, False), (i + 1, j + 1, True)] + ([(j + 2, n, False)] if j + 1 < n else [])
+                    if score(pieces) < legs[2][-1] - 1e-9:
+                        apply(pieces)
+                        improved = True
+                        break
+            
+            # or-opt: move 1 to 3 consecutive stops (either way round) next to a neighbour
+            for length in (1, 2, 3):
+                i = 0
+                while i + length <= n:
+                    # Segment tour[i:i + length] is route[i + 1..i + length]
+                    moved = False
+                    for neighbour in neighbours[route[i + 1]]:
+                        k = position[int(neighbour)]
+                        if i <= k < i + length:
+                            continue
+                        k = k if k < i else k - length  # Index in the tour without the segment
+                        for insert in (k, k + 1):
+                            for reverse in (False, True):
+                                if insert == i and not reverse:
+                                    continue  # Same tour
+                                segment = (i + 1, i + length, reverse)
+                                if insert < i:
+                                    pieces = [(0, insert, False), segment, (insert + 1, i, False), (i + length + 1, n, False)]
+                                else:
+                                    pieces = [(0, i, False), (i + length + 1, insert + length, False), segment, (insert + length + 1, n, False)]
+                                pieces = [piece for piece in pieces if piece[0] <= piece[1]]
+                                if score(pieces) < legs[2][-1] - 1e-9:
+                                    apply(pieces)
+                                    improved = moved = True
+                                    break
+                            if moved:
+                                break
+                        if moved:
+                            break
+                    i += 1
+            
+            if not improved:
+                break
+        return tour
+
+    def optimize(self, points: np.ndarray, exhaustive: int = 7, neighbour_count: int = 10) -> list[int]:
+        """
+        Near optimal visiting order of the stops (indexes into points), never slower than file order.
+        :param exhaustive: Up to this many stops every order is tried
+        :param neighbour_count: Nearest stops tried as move targets by refine
+        """
+        n = len(points)
+        file_order = list(range(n))
+        if n < 2:
+            return file_order
+        if n <= exhaustive:
+            return list(min(itertools.permutations(file_order), key=lambda order: self.mission_time(points, order)))
+        
+        times = self.travel_times(points)
+        np.fill_diagonal(times, np.inf)
+        neighbours = np.argsort(times[:, 1:], axis=1)[:, :min(neighbour_count, n - 1)]
+        times[np.isinf(times)] = 0.0
+        
+        # Start from the faster of the distance tour and the file order, then count turns too
+        tour = [index - 1 for index in self.two_opt(times, self.nearest_neighbour(times))]
+        tour = min((tour, file_order), key=lambda order: self.mission_time(points, order))
+        tour = self.refine(points, tour, neighbours)
+        
+        if self.mission_time(points, tour) >= self.mission_time(points, file_order):
+            return file_order
+        return tour
+
+    # MARK: Plan
+    def plan(self, names: list[str], points: np.ndarray, order = None) -> list[tuple[str, list[tuple[str, float]]]]:
+        """
+        Movement plan steps for visiting the stops in order (optimized when order is None).
+        """
+        order = self.optimize(points) if order is None else order
+        legs = self.legs(points, order)
+        if self.stop_time:
+            for operations in legs:
+                operations.append(("stop", self.stop_time))
+        return [(names[index], operations) for index, operations in zip(order, legs)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan the fastest route of the robot through the stops")
+    parser.add_argument("stops", nargs="?", default="movements/stops.csv", help="CSV of the stops (Stop,X,Y)")
+    parser.add_argument("--output", default="movements/movements.csv", help="Movement plan to write")
+    parser.add_argument("--stop-time", type=float, default=0.0, help="Seconds spent at every stop")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the estimates")
+    args = parser.parse_args()
+
+    names, points = load_stops(args.stops)
+    planner = RoutePlanner(stop_time=args.stop_time)
+    order = planner.optimize(points)
+
+    before = planner.mission_time(points, range(len(points)))
+    after = planner.mission_time(points, order)
+    if after >= before:
+        order, after = list(range(len(points))), before
+    print(f"Stops: {len(points)}")
+    print(f"Estimated mission time in file order: {before:.1f} seconds")
+    print(f"Estimated mission time optimized:     {after:.1f} seconds")
+    if after < before:
+        print(f"\033[32mSaved {before - after:.1f} seconds ({(before - after) / before:.0%})\033[0m")
+    else:
+        print("\033[33mFile order is already the fastest found, keeping it\033[0m")
+
+    if not args.dry_run:
+        write_plan(planner.plan(names, points, order), args.output)
+        print(f"\033[32mMovement plan saved to {args.output}\033[0m")
+
+if __name__ == "__main__":
+    main()
@@ -6,18 +6,22 @@
     Opens movements.txt
     Uses predefined distances to move the robot
     Uses predefined angles to turn the robot
+    
+    Compiles movements.csv once into a validated plan
+    -> cached until the CSV changes
+    eg: plan = load_plan()
+        execute_step(plan[0])
 """
 
+import os
 import csv
-import json
-import RPi.GPIO as GPIO
-from time import sleep
+import threading
+from array import array
+from hardware import GPIO, sleep, load_config
 
 # MARK: Load pins
 """Load already selected pins from config.json."""
-with open("config.json", "r") as f:
-    config = json.load(f)
-    f.close()
+config = load_config()
 
 # Motor driver pins
 IN1 = config["L298N"]["IN1"]
@@ -27,81 +31,88 @@ IN3 = config["L298N"]["IN3"]
 IN4 = config["L298N"]["IN4"]
 ENB = config["L298N"]["ENB"]
 
-# Setup GPIO mode and pins
-GPIO.setmode(GPIO.BOARD)
-GPIO.setup(ENA, GPIO.OUT)
-GPIO.setup(IN1, GPIO.OUT)
-GPIO.setup(IN2, GPIO.OUT)
-GPIO.setup(ENB, GPIO.OUT)
-GPIO.setup(IN3, GPIO.OUT)
-GPIO.setup(IN4, GPIO.OUT)
-
-# Initialize PWM
-pwm_ENA = GPIO.PWM(ENA, 1000)
-pwm_ENB = GPIO.PWM(ENB, 1000)
+# PWM of both motors, created by setup on first use
+pwm_ENA = None
+pwm_ENB = None
+setup_lock = threading.Lock()
 
 # Predefined distances and angles
 DISTANCE_TIME = 1  # Define your multiplier of distance # TODO: Change value
 ANGLE_TIME = 1     # Define your multiplier of angle    # TODO: Change value
 SPEED = 30                                              # TODO: Change value
 
+# MARK: Setup
+def setup():
+    """Set up the GPIO pins and PWM of the motor driver the first time they are needed."""
+    global pwm_ENA, pwm_ENB
+    if pwm_ENB is not None:
+        return
+    with setup_lock:
+        if pwm_ENB is not None:
+            return
+        # Setup GPIO mode and pins
+        GPIO.setmode(GPIO.BOARD)
+        GPIO.setup(ENA, GPIO.OUT)
+        GPIO.setup(IN1, GPIO.OUT)
+        GPIO.setup(IN2, GPIO.OUT)
+        GPIO.setup(ENB, GPIO.OUT)
+        GPIO.setup(IN3, GPIO.OUT)
+        GPIO.setup(IN4, GPIO.OUT)
+        
+        # Initialize PWM
+        pwm_ENA = GPIO.PWM(ENA, 1000)
+        pwm_ENB = GPIO.PWM(ENB, 1000)
+
 # MARK: Movement
+# Pin states (IN1, IN2, IN3, IN4) of every action
+DRIVE_PINS = {
+    "stop":     (GPIO.LOW,  GPIO.LOW,  GPIO.LOW,  GPIO.LOW),
+    "forward":  (GPIO.HIGH, GPIO.LOW,  GPIO.HIGH, GPIO.LOW),
+    "backward": (GPIO.LOW,  GPIO.HIGH, GPIO.LOW,  GPIO.HIGH),
+    "left":     (GPIO.LOW,  GPIO.HIGH, GPIO.HIGH, GPIO.LOW),
+    "right":    (GPIO.HIGH, GPIO.LOW,  GPIO.LOW,  GPIO.HIGH),
+}
+
+def drive(action: str, speed: int = SPEED):
+    """Set the motor driver for an action and return immediately, the motors keep running."""
+    setup()
+    duty_cycle = 0 if action == "stop" else speed
+    pwm_ENA.start(duty_cycle)
+    pwm_ENB.start(duty_cycle)
+    for pin, state in zip((IN1, IN2, IN3, IN4), DRIVE_PINS[action]):
+        GPIO.output(pin, state)
+
 # Function to stop the robot
 def stop(duration : int = 0):
     print(f"Stopping for {duration} seconds")
-    pwm_ENA.start(0)
-    pwm_ENB.start(0)
-    GPIO.output(IN1, GPIO.LOW)
-    GPIO.output(IN2, GPIO.LOW)
-    GPIO.output(IN3, GPIO.LOW)
-    GPIO.output(IN4, GPIO.LOW)
+    drive("stop")
     sleep(duration)
 
 # Function to move the robot forward
 def move_forward(duration : int = 2):
     print(f"Moving forward for {duration} seconds")
-    pwm_ENA.start(SPEED)
-    pwm_ENB.start(SPEED)
-    GPIO.output(IN1, GPIO.HIGH)
-    GPIO.output(IN2, GPIO.LOW)
-    GPIO.output(IN3, GPIO.HIGH)
-    GPIO.output(IN4, GPIO.LOW)
+    drive("forward")
     sleep(duration)
     stop()
 
 # Function to move the robot backward
 def move_backward(duration: int = 1):
     print(f"Moving backward for {duration} seconds")
-    pwm_ENA.start(SPEED)
-    pwm_ENB.start(SPEED)
-    GPIO.output(IN1, GPIO.LOW)
-    GPIO.output(IN2, GPIO.HIGH)
-    GPIO.output(IN3, GPIO.LOW)
-    GPIO.output(IN4, GPIO.HIGH)
+    drive("backward")
     sleep(duration)
     stop()
 
 # Function to turn the robot left
 def move_left(duration: int = 1):
     print(f"Turning left for {duration} seconds")
-    pwm_ENA.start(SPEED)
-    pwm_ENB.start(SPEED)
-    GPIO.output(IN1, GPIO.LOW)
-    GPIO.output(IN2, GPIO.HIGH)
-    GPIO.output(IN3, GPIO.HIGH)
-    GPIO.output(IN4, GPIO.LOW)
+    drive("left")
     sleep(duration)
     stop()
 
 # Function to turn the robot right
 def move_right(duration : int = 2):
     print(f"Moving right for {duration} seconds")
-    pwm_ENA.start(100)
-    pwm_ENB.start(100)
-    GPIO.output(IN1, GPIO.HIGH)
-    GPIO.output(IN2, GPIO.LOW)
-    GPIO.output(IN3, GPIO.LOW)
-    GPIO.output(IN4, GPIO.HIGH)
+    drive("right", 100)
     sleep(duration)
 
 # MARK: File handling
@@ -112,61 +123,165 @@ def read_csv(file_path: str = 'movements/movements.csv'):
         data = list(reader)
         return data[1:]
 
-# Function to return a specific line from the CSV file
+# Function to return a specific line from the CSV file (or step of a compiled plan)
 def get_csv_line(file_content, line_number: int):
     if 0 <= line_number < len(file_content):
         return file_content[line_number]
     raise IndexError("\n\033[31mLine number out of range\033[0m")
 
+# MARK: Plan
+# Actions in the order of their op codes
+ACTION_NAMES = ("stop", "forward", "backward", "left", "right")
+ACTION_CODES = {name: code for code, name in enumerate(ACTION_NAMES)}
+
+class MovementPlan:
+    """
+    Compiled movements.csv, every step is a sequence of (op code, duration) operations.
+    
+    Stored as flat typed arrays so very large route files stay small in memory,
+    plan[i] returns the operations of step i.
+    """
+    def __init__(self) -> None:
+        self.codes = array('B')
+        self.durations = array('d')
+        self.starts = array('L', [0])
+    
+    def append(self, operations) -> None:
+        for code, duration in operations:
+            self.codes.append(code)
+            self.durations.append(duration)
+        self.starts.append(len(self.codes))
+    
+    def __len__(self) -> int:
+        return len(self.starts) - 1
+    
+    def __getitem__(self, index: int) -> list[tuple[int, float]]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("\n\033[31mLine number out of range\033[0m")
+        start, end = self.starts[index], self.starts[index + 1]
+        return list(zip(self.codes[start:end], self.durations[start:end]))
+    
+    def duration(self, index: int) -> float:
+        """Total duration of the operations of step index."""
+        return sum(self.durations[self.starts[index]:self.starts[index + 1]])
+
+def parse_step(line: list, line_number: int = 0) -> list[tuple[int, float]]:
+    """
+    Compile one CSV row (label, "direction:duration", ...) into operations.
+    Raises ValueError naming the line for unknown actions or invalid durations.
+    """
+    operations = []
+    for action in line[1:]:
+        if not action.strip():
+            continue
+        direction, separator, duration = action.partition(':')
+        direction = direction.lower().strip()
+        if not separator or direction not in ACTION_CODES:
+            raise ValueError(f"line {line_number}: unknown action '{action.strip()}'")
+        try:
+            duration = float(duration)
+        except ValueError:
+            raise ValueError(f"line {line_number}: invalid duration in '{action.strip()}'") from None
+        if duration < 0:
+            raise ValueError(f"line {line_number}: negative duration in '{action.strip()}'")
+        operations.append((ACTION_CODES[direction], duration))
+    return operations
+
+def stream_plan(file_path: str = 'movements/movements.csv'):
+    """
+    Yield the compiled operations of every step without loading the whole file.
+    """
+    with open(file_path, 'r', newline='') as file:
+        reader = csv.reader(file)
+        next(reader, None)  # Header
+        for line in reader:
+            yield parse_step(line, reader.line_num)
+
+def compile_plan(file_path: str = 'movements/movements.csv') -> MovementPlan:
+    """
+    Parse and validate the whole CSV, reporting every malformed entry before the mission starts.
+    """
+    plan = MovementPlan()
+    errors = []
+    with open(file_path, 'r', newline='') as file:
+        reader = csv.reader(file)
+        next(reader, None)  # Header
+        for line in reader:
+            try:
+                plan.append(parse_step(line, reader.line_num))
+            except ValueError as e:
+                errors.append(str(e))
+                plan.append([])
+    if errors:
+        raise ValueError(f"Invalid movements in {file_path}:\n" + "\n".join(errors))
+    return plan
+
+# Compiled plans by path with the (mtime, size) of the CSV they were compiled from
+compiled_plans: dict[str, tuple[tuple[int, int], MovementPlan]] = {}
+
+def load_plan(file_path: str = 'movements/movements.csv') -> MovementPlan:
+    """
+    Return the compiled plan of a CSV, compiling it again only when the file changed.
+    """
+    stat = os.stat(file_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = compiled_plans.get(file_path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    plan = compile_plan(file_path)
+    compiled_plans[file_path] = (version, plan)
+    return plan
+
 # MARK: Execution
-# Function to execute movements based on CSV line content
-def execute_movements(line: list):
+# Movement function of every op code
+ACTIONS = (stop, move_forward, move_backward, move_left, move_right)
+
+def execute_step(operations):
+    """
+    Run compiled operations through the dispatch table, always stopping at the end.
+    """
     try:
-        line = line[1:]
-        line = [item for item in line if item]
-        for action in line:
-            direction, duration = action.split(':')
-            direction = direction.lower().strip()
-            duration = int(duration)
-            if direction == 'forward':
-                move_forward(duration)
-            elif direction == 'backward':
-                move_backward(duration)
-            elif direction == 'left':
-                move_left(duration)
-            elif direction == 'right':
-                move_right(duration)
-            elif direction == 'stop':
-                stop(duration)
-            else:
-                print(f"\n\033[31mUnknown action: {direction}\033[0m")
-    except ValueError:
-        print("\n\033[31mError: Invalid duration value\033[0m")
+        for code, duration in operations:
+            ACTIONS[code](duration)
     except Exception as e:
         print(f"\033[31mAn error occurred: {e}\033[0m")
     finally:
         stop()
 
+# Function to execute movements based on CSV line content
+def execute_movements(line: list):
+    try:
+        operations = parse_step(line)
+    except ValueError as e:
+        print(f"\n\033[31mError: {e}\033[0m")
+        stop()
+        return
+    execute_step(operations)
+
 def execute_line(line_number: int, file_content = None, file_name : str = 'movements/movements.csv'):
     line_number -= 1
     if file_content is None:
-        file_content = read_csv(file_name)
+        file_content = load_plan(file_name)
     line = get_csv_line(file_content, line_number)
-    if line is not None:
+    if isinstance(file_content, MovementPlan):
+        execute_step(line)
+    elif line is not None:
         execute_movements(line)
     else:
         print(f"\033[31mError: Invalid line number {line_number} in the CSV file.\033[0m")
 
 def main(file_name: str = 'movements/movements.csv'):
-    file_content = read_csv(file_name)
-    for line_number in range(1, len(file_content)):
-        yield execute_line(line_number, file_content)
+    plan = load_plan(file_name)
+    for line_number in range(1, len(plan) + 1):
+        yield execute_line(line_number, plan)
 
 if __name__ == "__main__":
     try:
         i = 0
-        file_content = read_csv()
-        while i < len(file_content):
+        plan = load_plan()
+        while i < len(plan):
             for _ in main():
                 i += 1
     except KeyboardInterrupt:
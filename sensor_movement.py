@@ -6,15 +6,12 @@
     Controlled using L298N Motor driver
 """
 
-import RPi.GPIO as GPIO
-from time import sleep
-import json
+from hardware import GPIO, sleep, load_config
+import threading
 
 # MARK: Load pins
 """Load already selected pins from config.json."""
-with open("config.json", "r") as f:
-    config = json.load(f)
-    f.close()
+config = load_config()
 
 # Define GPIO pins for L298N Motor Driver
 IN1 = config["SENSOR_MOVEMENT"]["IN1"]
@@ -25,37 +22,59 @@ ENA = config["SENSOR_MOVEMENT"]["ENA"]
 sensor_movement: int = 2  # TODO: Change value
 movement_speed: int = 100 # TODO: Change value
 
-# Setup GPIO mode
-GPIO.setmode(GPIO.BOARD)
-GPIO.setup(IN1, GPIO.OUT)
-GPIO.setup(IN2, GPIO.OUT)
-GPIO.setup(ENA, GPIO.OUT)
+# PWM on ENA pin, created by setup on first use
+pwm = None
+setup_lock = threading.Lock()
 
-# Initialize PWM on ENA pin
-pwm = GPIO.PWM(ENA, 100)
-pwm.start(0)
+# MARK: Setup
+def setup():
+    """Set up the GPIO pins and PWM of the sensor motor the first time they are needed."""
+    global pwm
+    if pwm is not None:
+        return
+    with setup_lock:
+        if pwm is not None:
+            return
+        # Setup GPIO mode
+        GPIO.setmode(GPIO.BOARD)
+        GPIO.setup(IN1, GPIO.OUT)
+        GPIO.setup(IN2, GPIO.OUT)
+        GPIO.setup(ENA, GPIO.OUT)
+        
+        # Initialize PWM on ENA pin
+        sensor_pwm = GPIO.PWM(ENA, 100)
+        sensor_pwm.start(0)
+        pwm = sensor_pwm
 
 # MARK: Movement
+# Pin states (IN1, IN2) of every direction
+DRIVE_PINS = {
+    "stop": (GPIO.LOW,  GPIO.LOW),
+    "up":   (GPIO.HIGH, GPIO.LOW),
+    "down": (GPIO.LOW,  GPIO.HIGH),
+}
+
+def drive(direction: str, speed: int = movement_speed):
+    """Set the sensor motor for a direction and return immediately, the motor keeps running."""
+    setup()
+    GPIO.output(IN1, DRIVE_PINS[direction][0])
+    GPIO.output(IN2, DRIVE_PINS[direction][1])
+    pwm.ChangeDutyCycle(0 if direction == "stop" else speed)
+
 def move_up(duration: int = sensor_movement, speed: int = movement_speed):
-    GPIO.output(IN1, GPIO.HIGH)
-    GPIO.output(IN2, GPIO.LOW)
-    pwm.ChangeDutyCycle(speed)
+    drive("up", speed)
     print(f"Sensor Moving up for {duration} seconds at speed {speed}")
     sleep(duration)
     stop_motor()
 
 def move_down(duration: int = sensor_movement, speed: int = movement_speed):
-    GPIO.output(IN1, GPIO.LOW)
-    GPIO.output(IN2, GPIO.HIGH)
-    pwm.ChangeDutyCycle(speed)
+    drive("down", speed)
     print(f"Sensor Moving down for {duration} seconds at speed {speed}")
     sleep(duration)
     stop_motor()
 
 def stop_motor(duration: int= 0):
-    GPIO.output(IN1, GPIO.LOW)
-    GPIO.output(IN2, GPIO.LOW)
-    pwm.ChangeDutyCycle(0)
+    drive("stop")
     print("Sensor Movement stopped")
     sleep(duration)
 
@@ -0,0 +1,112 @@
+# stage_timer.py
+"""
+    Code that times the stages of a pipeline
+    
+    Keeps a rolling window of latencies per stage
+    -> p50 / p95 / p99 latencies in milliseconds
+    -> can be dumped to a json file
+    -> costs nothing but a method call when disabled
+    eg: timer = StageTimer(enabled=True)
+        with timer.stage("convert"):
+            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        print(timer.summary())
+"""
+
+import json
+import threading
+from time import perf_counter
+from collections import deque
+from contextlib import nullcontext
+
+# Shared context returned while disabled, nothing is measured
+NO_TIMING = nullcontext()
+
+class StageTimer:
+    # MARK: init
+    def __init__(self, enabled : bool = False, window : int = 1000) -> None:
+        """
+        :param enabled: Collect timings
+        :param window: Number of latest samples kept per stage
+        """
+        self.enabled : bool = enabled
+        self.window : int = window
+        self.samples : dict[str, deque] = {}
+        self.counts : dict[str, int] = {}
+        # Stages are recorded from the processing thread and read from others
+        self.lock = threading.Lock()
+    
+    # MARK: Stage
+    def stage(self, name : str):
+        """
+        Return a context manager that times the enclosed block as stage name.
+        """
+        if not self.enabled:
+            return NO_TIMING
+        return _StageContext(self, name)
+    
+    # MARK: Record
+    def record(self, name : str, seconds : float) -> None:
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+                self.counts[name] = 0
+            self.samples[name].append(seconds)
+            self.counts[name] += 1
+    
+    # MARK: Reset
+    def reset(self) -> None:
+        with self.lock:
+            self.samples.clear()
+            self.counts.clear()
+    
+    # MARK: Summary
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        Return count, mean, p50, p95, p99 and max latency (ms) of every stage.
+        """
+        with self.lock:
+            snapshot = {name: (sorted(samples), self.counts[name]) for name, samples in self.samples.items()}
+        
+        summary = {}
+        for name, (ordered, count) in snapshot.items():
+            if not ordered:
+                continue
+            last = len(ordered) - 1
+            summary[name] = {
+                "count": count,
+                "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+                "p50": round(ordered[round(last * 0.50)] * 1000, 3),
+                "p95": round(ordered[round(last * 0.95)] * 1000, 3),
+                "p99": round(ordered[round(last * 0.99)] * 1000, 3),
+                "max": round(ordered[-1] * 1000, 3),
+            }
+        return summary
+    
+    # MARK: Dump
+    def dump(self, file_path : str = "stage_timings.json") -> None:
+        with open(file_path, "w") as file:
+            json.dump(self.summary(), file, indent=4)
+        print(f"Stage timings saved to {file_path}")
+    
+    # MARK: Print
+    def print_summary(self) -> None:
+        for name, stats in self.summary().items():
+            print(f"{name:>12}: n={stats['count']} p50={stats['p50']}ms p95={stats['p95']}ms p99={stats['p99']}ms")
+
+class _StageContext:
+    """
+    Times one block and records it on exit.
+    """
+    __slots__ = ("timer", "name", "start")
+    
+    def __init__(self, timer : StageTimer, name : str) -> None:
+        self.timer = timer
+        self.name = name
+    
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+    
+    def __exit__(self, *exc) -> bool:
+        self.timer.record(self.name, perf_counter() - self.start)
+        return False
@@ -0,0 +1,96 @@
+# telemetry_buffer.py
+"""
+    Code that stores telemetry until it has been uploaded
+    
+    Keeps every reading in a local SQLite database
+    -> a reading is stored the moment it is recorded, before any network call
+    -> unsent readings are read oldest first and marked sent only after a successful upload,
+       so replaying after a crash only sends the same values again
+    -> disk usage is bounded by the number of rows kept
+    eg: buffer = TelemetryBuffer("telemetry.db")
+        buffer.record({"v0": 40, "v1": "rose"})
+        rows = buffer.unsent()
+        buffer.mark_sent([row_id for row_id, _, _ in rows])
+"""
+
+import json
+import sqlite3
+import threading
+from time import time
+
+class TelemetryBuffer:
+    # MARK: init
+    def __init__(self, path : str = "telemetry.db", max_rows : int = 10000) -> None:
+        """
+        :param path: SQLite database file
+        :param max_rows: Rows kept at most, sent rows are removed first
+        """
+        self.path : str = path
+        self.max_rows : int = max_rows
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            # WAL keeps writes cheap and the file consistent if power is lost
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS readings ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "created REAL NOT NULL, "
+                "pins TEXT NOT NULL, "
+                "sent INTEGER NOT NULL DEFAULT 0)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS unsent ON readings (sent, id)")
+    
+    # MARK: Record
+    def record(self, pins : dict) -> int:
+        """
+        Store the pin values of one reading, returns its id.
+        """
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO readings (created, pins) VALUES (?, ?)", (time(), json.dumps(pins))
+            )
+            self.trim()
+            return cursor.lastrowid
+    
+    # MARK: Unsent
+    def unsent(self, limit : int = 500) -> list[tuple[int, float, dict]]:
+        """
+        Return up to limit unsent readings as (id, created, pins), oldest first.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, created, pins FROM readings WHERE sent = 0 ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+        return [(row_id, created, json.loads(pins)) for row_id, created, pins in rows]
+    
+    # MARK: Pending
+    def pending(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM readings WHERE sent = 0").fetchone()[0]
+    
+    # MARK: Mark Sent
+    def mark_sent(self, ids : list[int]) -> None:
+        if not ids:
+            return
+        with self.lock, self.connection:
+            self.connection.executemany("UPDATE readings SET sent = 1 WHERE id = ?", [(row_id,) for row_id in ids])
+    
+    # MARK: Trim
+    def trim(self) -> None:
+        """
+        Keep at most max_rows rows, removing sent rows first and then the oldest unsent.
+        Must be called with the lock held inside a transaction.
+        """
+        count = self.connection.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+        excess = count - self.max_rows
+        if excess <= 0:
+            return
+        self.connection.execute(
+            "DELETE FROM readings WHERE id IN (SELECT id FROM readings ORDER BY sent DESC, id LIMIT ?)", (excess,)
+        )
+    
+    # MARK: Close
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,106 @@
+# water_planner.py
+"""
+    Code that plans the water needed for many plants at once
+    
+    Same model as get_water_needed in main.py, evaluated with NumPy for whole arrays
+    -> S : water needed by the species
+    -> R : rain forecast weighted by temperature, humidity and time decay
+    -> M : soil moisture adjustment
+    -> E : evapotranspiration adjustment (temperature, humidity, wind)
+    -> water needed = max(0, S - (R + M) + E - leaf water content adjustment)
+    
+    All inputs broadcast, so a field can be planned in one call and what-if sweeps
+    are done by passing arrays of weather values or coefficients
+    eg: planner = WaterPlanner()
+        planner.plan(species=["rose", "tulip"], moisture=[40, 55], water_content=[60, 70],
+                     species_water_content=values, temperature=30, humidity=70, rain=[0, 1.2, 0, 0])
+"""
+
+import numpy as np
+
+class WaterPlanner:
+    # MARK: init
+    def __init__(self, decay = (0.25, 0.5, 0.75, 1.0), moisture_factor : float = 0.5,
+                 temp_factor : float = 1.0, humidity_factor : float = 0.5,
+                 wind_factor : float = 0.0, water_content_factor : float = 0.0) -> None:
+        """
+        :param decay: Time decay of every forecast slot, one value per 3 hour slot
+        :param moisture_factor: Weight of the soil moisture (adjust for the soil type)
+        :param temp_factor: Temperature contribution to evapotranspiration
+        :param humidity_factor: Humidity contribution to evapotranspiration
+        :param wind_factor: Wind speed contribution to evapotranspiration (0 ignores wind)
+        :param water_content_factor: Weight of the leaf water content (0 ignores it)
+        """
+        self.decay = np.asarray(decay, dtype=np.float64)                 # TODO: Change
+        self.moisture_factor : float = moisture_factor                   # TODO: Change
+        self.temp_factor : float = temp_factor                           # TODO: Change
+        self.humidity_factor : float = humidity_factor                   # TODO: Change
+        self.wind_factor : float = wind_factor                           # TODO: Change
+        self.water_content_factor : float = water_content_factor         # TODO: Change
+    
+    # MARK: Species Needs
+    def species_needs(self, species, species_water_content):
+        """
+        Look up the water needed (S) of every species name.
+        """
+        names = np.asarray(species)
+        unique, inverse = np.unique(names, return_inverse=True)
+        values = np.array([float(species_water_content[name]) for name in unique])
+        return values[inverse].reshape(names.shape)
+    
+    # MARK: Rain
+    def effective_rain(self, temperature, humidity, rain, decay = None):
+        """
+        Weighted rain forecast (R), rain has the forecast slots on its last axis.
+        """
+        decay = self.decay if decay is None else np.asarray(decay, dtype=np.float64)
+        rain = np.asarray(rain, dtype=np.float64)[..., :decay.shape[-1]]
+        decay = decay[..., :rain.shape[-1]]
+        temperature = np.asarray(temperature, dtype=np.float64)[..., None]
+        humidity = np.asarray(humidity, dtype=np.float64)[..., None]
+        weight = np.maximum(0.0, 1.0 - temperature * decay / (humidity + 1.0))
+        return np.sum(weight * rain, axis=-1)
+    
+    # MARK: Plan
+    def plan(self, *, species = None, needs = None, moisture, water_content = 0.0,
+             species_water_content = None, temperature, humidity, wind_speed = 0.0,
+             rain = (0.0,), decay = None, round_to : int | None = 2):
+        """
+        Return the water needed by every plant.
+        
+        :param species: Species names, looked up in species_water_content (or pass needs)
+        :param needs: Water needed by every plant's species (S), instead of species
+        :param moisture: Soil moisture of every plant
+        :param water_content: Leaf water content of every plant
+        :param temperature: Temperature (broadcasts against the plants for sweeps)
+        :param humidity: Humidity
+        :param wind_speed: Wind speed
+        :param rain: Rain forecast in mm, forecast slots on the last axis
+        :param decay: Overrides the time decay of the forecast slots
+        
+        Raises ValueError if an input is missing (None) or not finite, so a failed
+        reading is never turned into a NaN amount of water.
+        """
+        if needs is None:
+            needs = self.species_needs(species, species_water_content)
+        inputs = {
+            "needs": needs, "moisture": moisture, "water_content": water_content,
+            "temperature": temperature, "humidity": humidity, "wind_speed": wind_speed, "rain": rain,
+        }
+        for name, value in inputs.items():
+            value = np.asarray(value, dtype=np.float64)
+            if not np.all(np.isfinite(value)):
+                raise ValueError(f"{name} has missing or non-finite values")
+            inputs[name] = value
+        needs, temperature, humidity = inputs["needs"], inputs["temperature"], inputs["humidity"]
+        
+        R = self.effective_rain(temperature, humidity, inputs["rain"], decay)
+        M = inputs["moisture"] * self.moisture_factor
+        E = (temperature * self.temp_factor) - (humidity * self.humidity_factor) \
+            + inputs["wind_speed"] * self.wind_factor
+        W = inputs["water_content"] * self.water_content_factor
+        
+        water_needed = np.maximum(0.0, needs - (R + M) + E - W)
+        if round_to is not None:
+            water_needed = np.round(water_needed, round_to)
+        return water_needed
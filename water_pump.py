@@ -5,59 +5,181 @@
     Turns on the water pump
     Waits for a certain amount of time
     Turns off the water pump
+    
+    Doses by calibrated volume without blocking the caller
+    -> soft-start ramps the duty cycle up instead of kicking the pump at full power
+    -> steady PWM (or on/off pulses to let the water soak in) timed with timers, no busy loop
+    -> returns a Dose that can be waited for or cancelled
+    eg: dose = dose_water(250)  # ml
+        ...                     # other work while the pump runs
+        dose.wait()
 """
 
-import RPi.GPIO as GPIO
-import time
-import json
+from hardware import GPIO, clock, load_config
+import threading
 
 # MARK: Load pins
 """Load already selected pins from config.json."""
-with open("config.json", "r") as f:
-    config = json.load(f)
-    f.close()
+config = load_config()
 
 # Define GPIO pins for L298N Motor Driver
 IN1 = config["WATER_PUMP"]["IN1"]
 IN2 = config["WATER_PUMP"]["IN2"]
 ENA = config["WATER_PUMP"]["ENA"]
 
-# Setup GPIO mode
-GPIO.setmode(GPIO.BOARD)
-GPIO.setup(IN1, GPIO.OUT)
-GPIO.setup(IN2, GPIO.OUT)
-GPIO.setup(ENA, GPIO.OUT)
+# Calibration, measured flow of the pump at 100% duty cycle
+FLOW_RATE: float = 10.0       # ml per second # TODO: Calibrate
+MIN_DUTY: int = 30            # Below this duty cycle the pump stalls # TODO: Calibrate
+SOFT_START: float = 0.5       # Seconds to ramp up from MIN_DUTY # TODO: Change
+SOFT_START_STEPS: int = 5
+
+# PWM on ENA pin, created by setup on first use
+pwm = None
+setup_lock = threading.Lock()
 
-# Initialize PWM on ENA pin
-pwm = GPIO.PWM(ENA, 1000)
+# Only one dose runs at a time
+pump_lock = threading.Lock()
+
+# MARK: Setup
+def setup():
+    """Set up the GPIO pins and PWM of the pump the first time they are needed."""
+    global pwm
+    if pwm is not None:
+        return
+    with setup_lock:
+        if pwm is not None:
+            return
+        # Setup GPIO mode
+        GPIO.setmode(GPIO.BOARD)
+        GPIO.setup(IN1, GPIO.OUT)
+        GPIO.setup(IN2, GPIO.OUT)
+        GPIO.setup(ENA, GPIO.OUT)
+        
+        # Initialize PWM on ENA pin
+        pump_pwm = GPIO.PWM(ENA, 1000)
+        pump_pwm.start(0)
+        pwm = pump_pwm
 
 # MARK: Functions
 def turn_on_pump(PWM : int):
+    setup()
     pwm.start(PWM)
     GPIO.output(IN1, GPIO.HIGH)
     GPIO.output(IN2, GPIO.LOW)
     print("Water pump is ON")
 
 def turn_off_pump():
+    setup()
     GPIO.output(IN1, GPIO.LOW)
     GPIO.output(IN2, GPIO.LOW)
     GPIO.output(ENA, 0)
     print("Water pump is OFF")
 
-def water(seconds : int, PWM : int = 100):
-    turn_on_pump(100) # TODO: change this
-    time.sleep(0.25)  # TODO: change this
-    turn_off_pump()
+def set_duty(duty_cycle: float):
+    """Run the pump at a steady duty cycle (0 stops it) without restarting the PWM."""
+    setup()
+    GPIO.output(IN1, GPIO.HIGH if duty_cycle > 0 else GPIO.LOW)
+    GPIO.output(IN2, GPIO.LOW)
+    pwm.ChangeDutyCycle(duty_cycle)
+
+def flow_rate(duty_cycle: float) -> float:
+    """Calibrated flow in ml per second at a duty cycle."""
+    return FLOW_RATE * duty_cycle / 100 if duty_cycle >= MIN_DUTY else 0.0
+
+# MARK: Dosing
+def dose_schedule(volume: float, duty_cycle: float = 100, pulse: tuple[float, float] | None = None) -> list[tuple[float, float]]:
+    """
+    Split a dose into (duty cycle, seconds) segments: soft-start ramp, then steady
+    flow, optionally as (on, off) second pulses.
+    """
+    if not volume > 0:
+        return []  # Nothing to pump (also rejects NaN)
+    duty_cycle = max(duty_cycle, MIN_DUTY)
+    segments = []
+    remaining = volume
     
-    start_time = time.time()
-    while time.time() - start_time < seconds:
-        turn_on_pump(PWM)
-        time.sleep(0.005)
-        turn_off_pump()
+    # Soft-start ramp from MIN_DUTY up to the duty cycle
+    step_time = SOFT_START / SOFT_START_STEPS
+    for step in range(SOFT_START_STEPS):
+        if remaining <= 0 or duty_cycle <= MIN_DUTY:
+            break
+        step_duty = MIN_DUTY + (duty_cycle - MIN_DUTY) * step / SOFT_START_STEPS
+        seconds = min(step_time, remaining / flow_rate(step_duty))
+        segments.append((step_duty, seconds))
+        remaining -= flow_rate(step_duty) * seconds
+    
+    # Steady flow for the rest of the volume
+    seconds = max(remaining, 0) / flow_rate(duty_cycle)
+    if pulse is None:
+        if seconds > 0:
+            segments.append((duty_cycle, seconds))
+        return segments
+    on, off = pulse
+    while seconds > 0:
+        segments.append((duty_cycle, min(on, seconds)))
+        seconds -= on
+        if seconds > 0:
+            segments.append((0, off))
+    return segments
+
+class Dose:
+    """
+    A dose running on its own timer thread.
+    """
+    def __init__(self, volume: float, segments: list[tuple[float, float]]) -> None:
+        self.volume: float = volume
+        self.segments = segments
+        self.delivered: float = 0.0   # Estimated ml pumped so far
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="dose", daemon=True)
+    
+    def run(self):
+        with pump_lock:
+            start_time = clock.monotonic()
+            try:
+                for duty_cycle, seconds in self.segments:
+                    if self.cancelled.is_set():
+                        break
+                    set_duty(duty_cycle)
+                    segment_start = clock.monotonic()
+                    interrupted = clock.wait(self.cancelled, seconds)
+                    self.delivered += flow_rate(duty_cycle) * min(clock.monotonic() - segment_start, seconds)
+                    if interrupted:
+                        break
+            finally:
+                set_duty(0)
+            print(f"Water pump dosed {self.delivered:.1f} ml in {clock.monotonic() - start_time:.1f} seconds")
+    
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until the dose finished, True if it did."""
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+    
+    def cancel(self):
+        """Stop the pump now."""
+        self.cancelled.set()
+    
+    def done(self) -> bool:
+        return not self.thread.is_alive()
+
+def dose_water(volume: float, duty_cycle: float = 100, pulse: tuple[float, float] | None = None) -> Dose:
+    """
+    Start pumping volume ml and return immediately.
+    :param duty_cycle: Steady duty cycle of the pump
+    :param pulse: (on, off) seconds to pulse the water instead of a steady flow
+    """
+    dose = Dose(volume, dose_schedule(volume, duty_cycle, pulse))
+    print(f"Water pump dosing {volume:.1f} ml")
+    dose.thread.start()
+    return dose
+
+def water(seconds : int, PWM : int = 100) -> Dose:
+    """Pump for seconds at a duty cycle, as a dose of the same volume."""
+    return dose_water(seconds * flow_rate(max(PWM, MIN_DUTY)), PWM)
 
 if __name__ == "__main__":
     try:
-        water(10, 20) # TODO: change this
+        water(10, 20).wait() # TODO: change this
     except KeyboardInterrupt:
         print("\033[32mKeyboard Interrupt\033[0m")
     except Exception as e:
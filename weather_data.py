@@ -7,115 +7,230 @@
     -> Gets rain forecast
     eg: get_weather("City")
         get_rain_forecast("City")
+    
+    Parses the whole forecast into arrays once
+    -> rain between any arrival time and a horizon
+    eg: get_forecast("City").rain_between(time(), 12)
+    
+    Responses are cached in memory and on disk for CACHE_TTL seconds
+    -> requests reuse pooled connections and time out after TIMEOUT seconds
+    -> the last good response is used when the network is down
 """
 
 import os
+import json
 import pytz
 import requests
+import numpy as np
+import threading
+from time import time
 from datetime import datetime
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from metrics import http_error
+from hardware import BACKEND, create_session
+
+# OpenWeatherMap updates its data about every 10 minutes
+CACHE_TTL: int = 600                       # TODO: Change
+CACHE_FILE: str = "sim_weather_cache.json" if BACKEND == "sim" else "weather_cache.json"  # Canned weather stays out of the real cache
+TIMEOUT: float = 5
+FAILURE_TTL: int = 60                      # Seconds a failed fetch is not retried # TODO: Change
+
+# Used when there is no response and nothing cached, so callers can still unpack
+DEFAULT_WEATHER = (0.0, 0.0, 0.0, "Unknown")
+DEFAULT_RAIN = (0, 0, 0, 0)
+
+session = create_session()
+session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+
+# {"endpoint:city": {"time": fetched at, "data": response json}}
+cache: dict[str, dict] = {}
+cache_lock = threading.Lock()
+cache_loaded: bool = False
+
+# {"endpoint:city": time of the last failed fetch}, skips the network while offline
+failures: dict[str, float] = {}
 
 def get_api():
     load_dotenv()
     return os.getenv('OPENWEATHER_API_KEY')
 
-# MARK: Weather
-def get_weather(CITY: str = 'Kozhikode'):
+# MARK: Cache
+def load_cache():
+    """Load the on-disk cache into memory once."""
+    global cache_loaded
+    if cache_loaded:
+        return
+    cache_loaded = True
+    try:
+        with open(CACHE_FILE, "r") as f:
+            cache.update(json.load(f))
+            f.close()
+    except FileNotFoundError:
+        pass
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"\033[31mIgnoring weather cache: {e}\033[0m")
+
+def save_cache():
+    try:
+        with open(CACHE_FILE + ".tmp", "w") as f:
+            json.dump(cache, f)
+        os.replace(CACHE_FILE + ".tmp", CACHE_FILE)
+    except OSError as e:
+        print(f"\033[31mError saving weather cache: {e}\033[0m")
+
+def fetch_json(endpoint: str, CITY: str, ttl: float = CACHE_TTL):
+    """
+    Return the json of an OpenWeatherMap endpoint for a city.
+    
+    Served from the cache while younger than ttl, else fetched. On any failure
+    the last good response is returned however old it is, None if there is none.
+    After a failure the network is not tried again for FAILURE_TTL seconds.
+    """
+    key = f"{endpoint}:{CITY}"
+    with cache_lock:
+        load_cache()
+        entry = cache.get(key)
+    
+    if entry and time() - entry["time"] < ttl:
+        return entry["data"]
+    
+    if time() - failures.get(key, float("-inf")) < FAILURE_TTL:
+        return entry["data"] if entry else None
+    
     API_KEY = get_api()
-    URL = f'http://api.openweathermap.org/data/2.5/weather?q={CITY}&appid={API_KEY}&units=metric'
+    URL = f'http://api.openweathermap.org/data/2.5/{endpoint}'
     
     try:
-        response = requests.get(URL)
+        response = session.get(URL, params={"q": CITY, "appid": API_KEY, "units": "metric"}, timeout=TIMEOUT)
         
         if response.status_code == 200:
-            weather_data = response.json()
-            
-            city_name = weather_data['name']
-            weather_main = weather_data['weather'][0]['main']
-            weather_description = weather_data['weather'][0]['description']
-            temperature = weather_data['main']['temp']
-            humidity = weather_data['main']['humidity']
-            wind_speed = weather_data['wind']['speed']
-            
-            print(f"\033[32mCurrent weather in {city_name}:\033[0m")
-            print(f"\033[32mCondition: {weather_main} ({weather_description})\033[0m")
-            print(f"\033[32mTemperature: {temperature}°C\033[0m")
-            print(f"\033[32mHumidity: {humidity}%\033[0m")
-            print(f"\033[32mWind Speed: {wind_speed} m/s\033[0m")
-            print("-" * 40)
-            
-            return temperature, humidity, wind_speed, weather_main
+            data = response.json()
+            with cache_lock:
+                cache[key] = {"time": time(), "data": data}
+                failures.pop(key, None)
+                save_cache()
+            return data
         else:
-            print(f"\033[31mError: Unable to fetch current weather data. Status code: {response.status_code}\033[0m")
+            http_error("openweathermap", response.status_code)
+            print(f"\033[31mError: Unable to fetch {endpoint} data. Status code: {response.status_code}\033[0m")
+    
+    except (requests.exceptions.RequestException, ValueError) as e:
+        http_error("openweathermap", e)
+        print(f"\033[31mAn error occurred while fetching {endpoint} data: {e}\033[0m")
     
-    except requests.exceptions.RequestException as e:
-        print(f"\033[31mAn error occurred while fetching current weather: {e}\033[0m")
+    failures[key] = time()
+    if entry:
+        age = int(time() - entry["time"])
+        print(f"\033[33mUsing cached {endpoint} data from {age} seconds ago\033[0m")
+        return entry["data"]
+    return None
+
+# MARK: Weather
+def get_weather(CITY: str = 'Kozhikode'):
+    weather_data = fetch_json("weather", CITY)
+    
+    if weather_data is None:
+        print(f"\033[31mError: No current weather data, using {DEFAULT_WEATHER}\033[0m")
+        return DEFAULT_WEATHER
+    
+    city_name = weather_data['name']
+    weather_main = weather_data['weather'][0]['main']
+    weather_description = weather_data['weather'][0]['description']
+    temperature = weather_data['main']['temp']
+    humidity = weather_data['main']['humidity']
+    wind_speed = weather_data['wind']['speed']
+    
+    print(f"\033[32mCurrent weather in {city_name}:\033[0m")
+    print(f"\033[32mCondition: {weather_main} ({weather_description})\033[0m")
+    print(f"\033[32mTemperature: {temperature}°C\033[0m")
+    print(f"\033[32mHumidity: {humidity}%\033[0m")
+    print(f"\033[32mWind Speed: {wind_speed} m/s\033[0m")
+    print("-" * 40)
+    
+    return temperature, humidity, wind_speed, weather_main
+
+# MARK: Forecast
+class Forecast:
+    """
+    Whole forecast response as compact arrays, one entry per 3 hour slot.
+    
+    -> time : forecast time (dt) as unix timestamp, the end of its slot
+    -> rain : rain in the slot (mm), OpenWeatherMap's rain.3h is the volume of the 3 hours up to dt
+    -> temperature : temperature (°C)
+    -> humidity : humidity (%)
+    """
+    SLOT: int = 3 * 3600
+    
+    def __init__(self, forecast_data) -> None:
+        entries = forecast_data.get('list', [])
+        count = len(entries)
+        self.time = np.fromiter((entry['dt'] for entry in entries), dtype=np.int64, count=count)
+        self.rain = np.fromiter((entry.get('rain', {}).get('3h', 0) for entry in entries), dtype=np.float32, count=count)
+        self.temperature = np.fromiter((entry.get('main', {}).get('temp', np.nan) for entry in entries), dtype=np.float32, count=count)
+        self.humidity = np.fromiter((entry.get('main', {}).get('humidity', np.nan) for entry in entries), dtype=np.float32, count=count)
+    
+    def __len__(self) -> int:
+        return len(self.time)
+    
+    def overlap(self, start: float, hours: float):
+        """Fraction of every slot (dt - 3h, dt] that lies between start and start + hours."""
+        end = start + hours * 3600
+        slot_start = self.time - self.SLOT
+        covered = np.minimum(self.time, end) - np.maximum(slot_start, start)
+        return np.clip(covered / self.SLOT, 0.0, 1.0)
+    
+    def rain_between(self, start: float, hours: float) -> float:
+        """Rain expected between start (unix time) and start + hours, partial slots count pro rata."""
+        return round(float(np.dot(self.overlap(start, hours), self.rain)), 2)
+    
+    def rain_slots(self, start: float, count: int = 4):
+        """Rain in each of the count 3 hour windows from start, eg: (0-3h, 3-6h, 6-9h, 9-12h)."""
+        return tuple(self.rain_between(start + i * self.SLOT, self.SLOT / 3600) for i in range(count))
+    
+    def mean_between(self, values, start: float, hours: float) -> float:
+        """Slot weighted mean of values (eg: forecast.temperature) between start and start + hours."""
+        weights = self.overlap(start, hours)
+        if not weights.any():
+            return float('nan')
+        return float(np.average(values, weights=weights))
+
+# Parsed forecasts by city, reused while the cached response does not change
+parsed_forecasts: dict[str, tuple[dict, Forecast]] = {}
+
+def get_forecast(CITY: str = 'Kozhikode'):
+    """
+    Return the forecast of a city as a Forecast, None if there is no data at all.
+    """
+    forecast_data = fetch_json("forecast", CITY)
+    if forecast_data is None:
+        return None
+    
+    parsed = parsed_forecasts.get(CITY)
+    if parsed is not None and parsed[0] is forecast_data:
+        return parsed[1]
+    
+    forecast = Forecast(forecast_data)
+    parsed_forecasts[CITY] = (forecast_data, forecast)
+    return forecast
 
 # MARK: Rain forecast
 def get_rain_forecast(CITY: str = 'Kozhikode', timezone : str = 'Asia/Kolkata'):
-    API_KEY = get_api()
-    URL = f'http://api.openweathermap.org/data/2.5/forecast?q={CITY}&appid={API_KEY}&units=metric'
+    forecast = get_forecast(CITY)
     
-    try:
-        response = requests.get(URL)
-        
-        if response.status_code == 200:
-            forecast_data = response.json()
-            
-            i = 0
-            rain_3h: int = 0
-            rain_6h: int = 0
-            rain_9h: int = 0
-            rain_12h: int = 0
-            
-            # Iterate over the forecast list (which contains 3-hour intervals)
-            for forecast in forecast_data['list']:
-                city_timezone = pytz.timezone(timezone)
-                
-                # Get the timestamp of the forecast
-                timestamp = forecast['dt']
-                
-                # Convert the timestamp to the city's local time
-                local_time = datetime.fromtimestamp(timestamp, city_timezone)
-                forecast_time = local_time.strftime('%H:%M:%S %d-%m-%Y')
-                
-                # Extract rain data (if available)
-                rain = forecast.get('rain', {}).get('3h', 0)  # Rain in the next 3 hours
-                
-                # Print the forecast time and rain data
-                print(f"\033[32mForecast for {forecast_time}:\033[0m")
-                if rain > 0:
-                    print(f"\033[32mExpected Rain: {rain} mm\033[0m")
-                else:
-                    print("\033[32mNo rain expected.\033[0m")
-                
-                print(forecast['dt_txt'])
-                print("-" * 40)
-                
-                if i == 0:
-                    rain_3h = rain
-                elif i == 1:
-                    rain_6h = rain
-                elif i == 2:
-                    rain_9h = rain
-                elif i == 3:
-                    rain_12h = rain
-                i += 1
-                
-                if rain_12h:
-                    print(f"\033[32mRain forecast for next 3 hours: {rain_3h} mm\033[0m")
-                    print(f"\033[32mRain forecast for the next 6 hours: {rain_6h} mm\033[0m")
-                    print(f"\033[32mRain forecast for the next 9 hours: {rain_9h} mm\033[0m")
-                    print(f"\033[32mRain forecast for the next 12 hours: {rain_12h} mm\033[0m")
-                    break
-                    
-            return rain_3h, rain_6h, rain_9h, rain_12h
-        
-        else:
-            print(f"\033[31mError: Unable to fetch weather forecast data. Status code: {response.status_code}\033[0m")
+    if forecast is None or not len(forecast):
+        print(f"\033[31mError: No weather forecast data, using {DEFAULT_RAIN}\033[0m")
+        return DEFAULT_RAIN
+    
+    # Rain of the first four 3 hour slots of the forecast
+    rain_3h, rain_6h, rain_9h, rain_12h = (float(rain) for rain in np.pad(forecast.rain[:4], (0, max(0, 4 - len(forecast)))))
+    
+    local_time = datetime.fromtimestamp(int(forecast.time[0]), pytz.timezone(timezone))
+    print(f"\033[32mRain forecast from {local_time.strftime('%H:%M:%S %d-%m-%Y')}: "
+          f"{rain_3h}, {rain_6h}, {rain_9h}, {rain_12h} mm (3h, 6h, 9h, 12h)\033[0m")
     
-    except requests.exceptions.RequestException as e:
-        print(f"\033[31mAn error occurred while fetching future rain forecast: {e}\033[0m")
+    return rain_3h, rain_6h, rain_9h, rain_12h
 
 def main():
     CITY = 'Kozhikode'  # You can change this to your desired city name # TODO: Change